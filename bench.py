@@ -0,0 +1,117 @@
+# py23 compatible
+from __future__ import print_function
+from __future__ import division
+from __future__ import unicode_literals
+from __future__ import absolute_import
+
+import shutil
+import sys
+import tempfile
+import time
+
+from . import dis
+
+# disassembler benchmark
+#
+# python -m librpydb.bench [module.py/.pyc ...]
+#
+# disassembles every code object of given modules (or a large stdlib module when none given)
+
+
+def _default_paths():
+    import inspect
+    import pydoc
+    return [inspect.getsourcefile(pydoc)]
+
+
+def collect(paths):
+    """
+    returns list of all code objects of modules at paths
+    """
+
+    codes = []
+    for path in paths:
+        codes.extend(dis.iter_code_objects(dis.load_code(path)))
+    return codes
+
+
+def run(codes, repeat=5, cached=False):
+    """
+    disassembles all code objects repeat times, returns (code objects, instructions, best time)
+
+    unless cached, decode cache is cleared before each repeat
+    """
+
+    instructions = 0
+    best = None
+    for _ in range(repeat):
+        instructions = 0
+        if not cached:
+            dis.clear_cache()
+        start = time.time()
+        for co in codes:
+            instructions += len(dis.dis(co))
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return len(codes), instructions, best
+
+
+def measure_allocations(codes):
+    """
+    disassembles all code objects, returns (allocated blocks, allocated bytes) held by results
+
+    returns None when tracemalloc is not available (python < 3.4)
+    """
+
+    try:
+        import tracemalloc
+    except ImportError:
+        return None
+
+    dis.clear_cache()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        results = [dis.dis(co) for co in codes]
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+
+    stats = after.compare_to(before, "filename")
+    del results
+    return sum(stat.count_diff for stat in stats), sum(stat.size_diff for stat in stats)
+
+
+def main(argv):
+    codes = collect(argv or _default_paths())
+    count, instructions, best = run(codes)
+    per_100k = 100000 / max(instructions, 1)
+    print("code objects: %d" % count)
+    print("instructions: %d" % instructions)
+    print("time: %.4f s (%.3f s per 100k instructions)" % (best, best * per_100k))
+    if dis.numpy is not None and dis._WORDCODE:
+        dis.set_numpy_backend(False)
+        count, instructions, best = run(codes)
+        print("python backend time: %.4f s (%.3f s per 100k instructions)" % (best, best * per_100k))
+        dis.set_numpy_backend(True)
+    count, instructions, best = run(codes, cached=True)
+    print("cached time: %.4f s (%.3f s per 100k instructions)" % (best, best * per_100k))
+    directory = tempfile.mkdtemp()
+    try:
+        dis.set_disk_cache(directory)
+        run(codes, repeat=1)
+        count, instructions, best = run(codes)
+        print("disk cache time: %.4f s (%.3f s per 100k instructions)" % (best, best * per_100k))
+    finally:
+        dis.set_disk_cache(None)
+        shutil.rmtree(directory)
+    allocations = measure_allocations(codes)
+    if allocations is not None:
+        blocks, size = allocations
+        print("allocations: %d blocks, %d bytes (%d blocks, %d kB per 100k instructions)"
+              % (blocks, size, blocks * per_100k, size * per_100k / 1024))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
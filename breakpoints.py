@@ -0,0 +1,638 @@
+# py23 compatible
+from __future__ import print_function
+from __future__ import division
+from __future__ import unicode_literals
+from __future__ import absolute_import
+
+import bisect
+import json
+import os
+
+from collections import OrderedDict
+
+from .protocol import DAPDataBreakpointAccessType
+from .utils import Counter, to_raw, to_str
+
+# version of saved breakpoints file format
+BREAKPOINTS_FILE_VERSION = 1
+
+
+def _sync_key(source_breakpoint):
+    return (source_breakpoint.get_line(),
+            source_breakpoint.get_condition_or_default(None),
+            source_breakpoint.get_hit_condition_or_default(None),
+            source_breakpoint.get_log_message_or_default(None))
+
+
+def _function_sync_key(function_breakpoint):
+    return (function_breakpoint.get_name(),
+            function_breakpoint.get_condition_or_default(None),
+            function_breakpoint.get_hit_condition_or_default(None))
+
+
+def _data_sync_key(data_breakpoint):
+    access_type = data_breakpoint.get_access_type_or_default(None)
+    return (data_breakpoint.get_data_id(),
+            getattr(access_type, "value", access_type),
+            data_breakpoint.get_condition_or_default(None),
+            data_breakpoint.get_hit_condition_or_default(None))
+
+
+class _AdapterBreakpoint(object):
+    """
+    Base of breakpoints that hold adapter side state, updated from responses and breakpoint events
+    """
+    def __init__(self):
+        # assigned by store when added
+        self.id = None
+        self._reset_adapter_state()
+
+    def _reset_adapter_state(self):
+        self.adapter_id = None
+        self.verified = False
+        self.actual_line = None
+        self.message = None
+
+    def _load_adapter_state(self, bp):
+        self.verified = bp.get_verified()
+        self.actual_line = bp.get_line_or_default(None)
+        self.message = bp.get_message_or_default(None)
+
+    def __ne__(self, o):
+        return not self.__eq__(o)
+
+
+class _AdapterStateStore(object):
+    """
+    Base of breakpoint stores, indexes stored breakpoints by id assigned by the adapter
+    """
+    def __init__(self):
+        self._id_counter = Counter()
+        self._by_adapter_id = {}
+
+    def get_by_adapter_id(self, adapter_id):
+        return self._by_adapter_id.get(adapter_id)
+
+    def _forget_adapter_id(self, breakpoint):
+        if breakpoint.adapter_id is not None and self._by_adapter_id.get(breakpoint.adapter_id) is breakpoint:
+            del self._by_adapter_id[breakpoint.adapter_id]
+        breakpoint._reset_adapter_state()
+
+    def _update_from_adapter(self, breakpoint, bp):
+        if bp.has_id():
+            if breakpoint.adapter_id != bp.get_id():
+                self._forget_adapter_id(breakpoint)
+            breakpoint.adapter_id = bp.get_id()
+            self._by_adapter_id[breakpoint.adapter_id] = breakpoint
+        breakpoint._load_adapter_state(bp)
+
+    def _find_event_breakpoint(self, bp):
+        if bp.has_id():
+            return self._by_adapter_id.get(bp.get_id())
+        return None
+
+    def _load_breakpoint_event(self, eb):
+        breakpoint = self._find_event_breakpoint(eb.get_breakpoint())
+        if breakpoint is None:
+            return
+
+        if eb.get_reason() == "removed":
+            self._forget_adapter_id(breakpoint)
+        else:
+            self._update_from_adapter(breakpoint, eb.get_breakpoint())
+
+
+class Breakpoint(_AdapterBreakpoint):
+    """
+    Line breakpoint.
+
+    condition and hit_condition are evaluated by the debuggee, if adapter supports them.
+    Breakpoint with log_message is a logpoint, it does not stop and only emits output.
+    Breakpoints are identified by line and source only.
+    """
+    def __init__(self, line, source, condition=None, hit_condition=None, log_message=None):
+        self.line = line
+        self.source = source
+        self.condition = condition
+        self.hit_condition = hit_condition
+        self.log_message = log_message
+        _AdapterBreakpoint.__init__(self)
+
+    def _load_adapter_state(self, bp):
+        _AdapterBreakpoint._load_adapter_state(self, bp)
+        if self.actual_line is None:
+            self.actual_line = self.line
+
+    def __eq__(self, o):
+        return self.line == o.line and self.source == o.source
+
+    def __hash__(self):
+        return hash((self.line, self.source))
+
+    def __repr__(self):
+        return "Breakpoint(%r, %r)" % (self.line, self.source)
+
+    def _same_options(self, o):
+        return (self.condition == o.condition and self.hit_condition == o.hit_condition and
+                self.log_message == o.log_message)
+
+    def is_logpoint(self):
+        return self.log_message is not None
+
+
+class BreakpointStore(_AdapterStateStore):
+    """
+    Breakpoints indexed by source, each source holding sorted array of lines.
+
+    Every stored breakpoint gets stable id which does not change until it is removed.
+    Also tracks sources whose breakpoints changed since they were last synced, what was
+    last sent for each source and which lines of each source the adapter acknowledged,
+    with their verification state.
+    """
+    def __init__(self):
+        _AdapterStateStore.__init__(self)
+        self._lines = {}
+        self._breakpoints = {}
+        self._by_id = {}
+        self._adapter_breakpoints = {}
+        self._sent_breakpoints = {}
+        self.dirty_sources = set()
+
+    def __len__(self):
+        return len(self._breakpoints)
+
+    def __iter__(self):
+        return iter(list(self._breakpoints.values()))
+
+    def __contains__(self, breakpoint):
+        return (breakpoint.source, breakpoint.line) in self._breakpoints
+
+    def add(self, breakpoint):
+        """
+        Adds breakpoint, returns False if same breakpoint is already present.
+
+        Breakpoint on the same line with different options replaces stored one and keeps its id.
+        """
+        key = (breakpoint.source, breakpoint.line)
+        if key in self._breakpoints:
+            stored = self._breakpoints[key]
+            if stored is breakpoint or stored._same_options(breakpoint):
+                return False
+
+            self._forget_adapter_id(stored)
+            breakpoint.id = stored.id
+            self._breakpoints[key] = breakpoint
+            self._by_id[breakpoint.id] = breakpoint
+            self.dirty_sources.add(breakpoint.source)
+            return True
+
+        if breakpoint.source not in self._lines:
+            self._lines[breakpoint.source] = []
+        bisect.insort(self._lines[breakpoint.source], breakpoint.line)
+
+        breakpoint.id = self._id_counter.get()
+        self._breakpoints[key] = breakpoint
+        self._by_id[breakpoint.id] = breakpoint
+        self.dirty_sources.add(breakpoint.source)
+        return True
+
+    def add_many(self, breakpoints):
+        """
+        Adds many breakpoints at once, sorting lines of each source only once.
+
+        Returns number of added breakpoints.
+        """
+        added = 0
+        touched = set()
+        for breakpoint in breakpoints:
+            key = (breakpoint.source, breakpoint.line)
+            stored = self._breakpoints.get(key)
+            if stored is not None:
+                if stored is not breakpoint and not stored._same_options(breakpoint):
+                    self.add(breakpoint)
+                    added += 1
+                continue
+
+            if breakpoint.source not in self._lines:
+                self._lines[breakpoint.source] = []
+            self._lines[breakpoint.source].append(breakpoint.line)
+            touched.add(breakpoint.source)
+
+            breakpoint.id = self._id_counter.get()
+            self._breakpoints[key] = breakpoint
+            self._by_id[breakpoint.id] = breakpoint
+            added += 1
+
+        for source in touched:
+            self._lines[source].sort()
+        self.dirty_sources.update(touched)
+        return added
+
+    def remove(self, breakpoint):
+        """
+        Removes breakpoint, raises KeyError if it is not present
+        """
+        key = (breakpoint.source, breakpoint.line)
+        stored = self._breakpoints.pop(key)
+        del self._by_id[stored.id]
+        self._forget_adapter_id(stored)
+
+        lines = self._lines[breakpoint.source]
+        del lines[bisect.bisect_left(lines, breakpoint.line)]
+        if len(lines) == 0:
+            del self._lines[breakpoint.source]
+
+        self.dirty_sources.add(breakpoint.source)
+        return stored
+
+    def remove_source(self, source):
+        """
+        Removes all breakpoints of source and returns them
+        """
+        removed = self.get_source_breakpoints(source)
+        for breakpoint in removed:
+            del self._breakpoints[(source, breakpoint.line)]
+            del self._by_id[breakpoint.id]
+            self._forget_adapter_id(breakpoint)
+        self._lines.pop(source, None)
+
+        if len(removed) > 0:
+            self.dirty_sources.add(source)
+        return removed
+
+    def clear(self):
+        self.dirty_sources.update(self._lines)
+        self._lines = {}
+        self._breakpoints = {}
+        self._by_id = {}
+        self._by_adapter_id = {}
+
+    def get(self, source, line):
+        return self._breakpoints.get((source, line))
+
+    def get_by_id(self, id):
+        return self._by_id.get(id)
+
+    def get_sources(self):
+        return list(self._lines)
+
+    def get_lines(self, source):
+        """
+        Returns sorted lines of breakpoints in source
+        """
+        return list(self._lines.get(source, []))
+
+    def get_source_breakpoints(self, source):
+        return [self._breakpoints[(source, line)] for line in self._lines.get(source, [])]
+
+    def get_range(self, source, start, end):
+        """
+        Returns breakpoints of source with start <= line <= end, ordered by line
+        """
+        lines = self._lines.get(source, [])
+        lo = bisect.bisect_left(lines, start)
+        hi = bisect.bisect_right(lines, end)
+        return [self._breakpoints[(source, line)] for line in lines[lo:hi]]
+
+    def get_unverified(self):
+        return [b for b in self._breakpoints.values() if not b.verified]
+
+    def get_adapter_lines(self, source):
+        """
+        Returns lines of source last acknowledged by the adapter
+        """
+        return [key[0] for key in self._adapter_breakpoints.get(source, ())]
+
+    def is_synced(self, source, source_breakpoints):
+        """
+        Returns True if exactly these source breakpoints of source were last sent to the adapter
+
+        Compares with what was sent, not acknowledged, so change made while request is pending is not lost.
+        """
+        return tuple(_sync_key(sb) for sb in source_breakpoints) == self._sent_breakpoints.get(source, ())
+
+    def mark_sent(self, source, source_breakpoints):
+        """
+        Records source breakpoints of source being sent to the adapter
+        """
+        self._sent_breakpoints[source] = tuple(_sync_key(sb) for sb in source_breakpoints)
+
+    def mark_all_dirty(self):
+        self.dirty_sources.update(self._lines)
+
+    def reset_adapter_state(self):
+        """
+        Forgets everything adapter reported, used when connecting to new adapter
+        """
+        for breakpoint in self._breakpoints.values():
+            breakpoint._reset_adapter_state()
+        self._by_adapter_id = {}
+        self._adapter_breakpoints = {}
+        self._sent_breakpoints = {}
+
+    def _load_breakpoints(self, rq, rb):
+        arguments = rq.get_arguments()
+        source = arguments.get_source().get_path()
+        keys = tuple(_sync_key(sb) for sb in arguments.get_breakpoints_or_default([]))
+        lines = [key[0] for key in keys]
+
+        # adapter replaced whole set of the source
+        requested = set(lines)
+        for key in self._adapter_breakpoints.get(source, ()):
+            breakpoint = self._breakpoints.get((source, key[0]))
+            if breakpoint is not None and key[0] not in requested:
+                self._forget_adapter_id(breakpoint)
+        self._adapter_breakpoints[source] = keys
+
+        # response breakpoints are in the same order as requested ones
+        for line, bp in zip(lines, rb.get_breakpoints()):
+            breakpoint = self._breakpoints.get((source, line))
+            if breakpoint is not None:
+                self._update_from_adapter(breakpoint, bp)
+
+    def _find_event_breakpoint(self, bp):
+        breakpoint = _AdapterStateStore._find_event_breakpoint(self, bp)
+        if breakpoint is None and bp.has_source() and bp.has_line():
+            breakpoint = self._breakpoints.get((bp.get_source().get_path_or_default(None), bp.get_line()))
+        return breakpoint
+
+    def pop_dirty_sources(self):
+        """
+        Returns sources changed since last call and clears them
+        """
+        dirty = self.dirty_sources
+        self.dirty_sources = set()
+        return dirty
+
+
+class FunctionBreakpoint(_AdapterBreakpoint):
+    """
+    Breakpoint on entry of function or label, identified by its name.
+    """
+    def __init__(self, name, condition=None, hit_condition=None):
+        self.name = name
+        self.condition = condition
+        self.hit_condition = hit_condition
+        _AdapterBreakpoint.__init__(self)
+
+    def __eq__(self, o):
+        return self.name == o.name
+
+    def __hash__(self):
+        return hash(self.name)
+
+    def __repr__(self):
+        return "FunctionBreakpoint(%r)" % (self.name,)
+
+    def _same_options(self, o):
+        return self.condition == o.condition and self.hit_condition == o.hit_condition
+
+
+class _KeyedBreakpointStore(_AdapterStateStore):
+    """
+    Base of stores of breakpoints that adapter replaces all at once, indexed by single key.
+
+    Since whole set is always sent, there is single dirty flag.
+    key returns store key of breakpoint, sync_key comparable key of DAP breakpoint sent for it.
+    """
+    def __init__(self, key, sync_key):
+        _AdapterStateStore.__init__(self)
+        self._key = key
+        self._sync_key = sync_key
+        self._breakpoints = OrderedDict()
+        self._adapter_breakpoints = ()
+        self._sent_breakpoints = ()
+        self.dirty = False
+
+    def __len__(self):
+        return len(self._breakpoints)
+
+    def __iter__(self):
+        return iter(list(self._breakpoints.values()))
+
+    def __contains__(self, breakpoint):
+        return self._key(breakpoint) in self._breakpoints
+
+    def add(self, breakpoint):
+        """
+        Adds breakpoint, returns False if same breakpoint is already present.
+
+        Breakpoint with the same key and different options replaces stored one and keeps its id.
+        """
+        key = self._key(breakpoint)
+        stored = self._breakpoints.get(key)
+        if stored is not None:
+            if stored is breakpoint or stored._same_options(breakpoint):
+                return False
+            self._forget_adapter_id(stored)
+            breakpoint.id = stored.id
+        else:
+            breakpoint.id = self._id_counter.get()
+
+        self._breakpoints[key] = breakpoint
+        self.dirty = True
+        return True
+
+    def remove(self, key):
+        """
+        Removes breakpoint by its key, raises KeyError if it is not present
+        """
+        stored = self._breakpoints.pop(key)
+        self._forget_adapter_id(stored)
+        self.dirty = True
+        return stored
+
+    def clear(self):
+        if len(self._breakpoints) > 0:
+            self.dirty = True
+        for breakpoint in self._breakpoints.values():
+            self._forget_adapter_id(breakpoint)
+        self._breakpoints = OrderedDict()
+
+    def get(self, key):
+        return self._breakpoints.get(key)
+
+    def get_keys(self):
+        return list(self._breakpoints)
+
+    def get_unverified(self):
+        return [b for b in self._breakpoints.values() if not b.verified]
+
+    def is_synced(self, dap_breakpoints):
+        """
+        Returns True if exactly these breakpoints were last sent to the adapter
+        """
+        return tuple(self._sync_key(b) for b in dap_breakpoints) == self._sent_breakpoints
+
+    def mark_sent(self, dap_breakpoints):
+        """
+        Records breakpoints being sent to the adapter
+        """
+        self._sent_breakpoints = tuple(self._sync_key(b) for b in dap_breakpoints)
+
+    def mark_all_dirty(self):
+        if len(self._breakpoints) > 0:
+            self.dirty = True
+
+    def pop_dirty(self):
+        """
+        Returns whether breakpoints changed since last call and clears the flag
+        """
+        dirty = self.dirty
+        self.dirty = False
+        return dirty
+
+    def reset_adapter_state(self):
+        """
+        Forgets everything adapter reported, used when connecting to new adapter
+        """
+        for breakpoint in self._breakpoints.values():
+            breakpoint._reset_adapter_state()
+        self._by_adapter_id = {}
+        self._adapter_breakpoints = ()
+        self._sent_breakpoints = ()
+
+    def _load_breakpoints(self, rq, rb):
+        keys = tuple(self._sync_key(b) for b in rq.get_arguments().get_breakpoints())
+        requested = set(key[0] for key in keys)
+
+        # adapter replaced whole set
+        for key in self._adapter_breakpoints:
+            breakpoint = self._breakpoints.get(key[0])
+            if breakpoint is not None and key[0] not in requested:
+                self._forget_adapter_id(breakpoint)
+        self._adapter_breakpoints = keys
+
+        # response breakpoints are in the same order as requested ones
+        for key, bp in zip(keys, rb.get_breakpoints()):
+            breakpoint = self._breakpoints.get(key[0])
+            if breakpoint is not None:
+                self._update_from_adapter(breakpoint, bp)
+
+
+class FunctionBreakpointStore(_KeyedBreakpointStore):
+    """
+    Function breakpoints indexed by name.
+    """
+    def __init__(self):
+        _KeyedBreakpointStore.__init__(self, lambda breakpoint: breakpoint.name, _function_sync_key)
+
+    def get_names(self):
+        return self.get_keys()
+
+
+class _AccessType(DAPDataBreakpointAccessType):
+    """
+    Generated access type enumeration carries no value, this one serializes as its string value
+    """
+    def __init__(self, value):
+        DAPDataBreakpointAccessType.__init__(self)
+        self.value = value
+
+    def serialize(self):
+        return self.value
+
+
+class DataBreakpoint(_AdapterBreakpoint):
+    """
+    Breakpoint on access of data (variable) identified by data id obtained from the adapter.
+
+    access_type is one of "read", "write" or "readWrite".
+    """
+    def __init__(self, data_id, access_type="write", condition=None, hit_condition=None, description=None):
+        self.data_id = data_id
+        self.access_type = access_type
+        self.condition = condition
+        self.hit_condition = hit_condition
+        self.description = description
+        _AdapterBreakpoint.__init__(self)
+
+    def __eq__(self, o):
+        return self.data_id == o.data_id
+
+    def __hash__(self):
+        return hash(self.data_id)
+
+    def __repr__(self):
+        return "DataBreakpoint(%r, %r)" % (self.data_id, self.access_type)
+
+    def _same_options(self, o):
+        return (self.access_type == o.access_type and self.condition == o.condition and
+                self.hit_condition == o.hit_condition)
+
+
+class DataBreakpointStore(_KeyedBreakpointStore):
+    """
+    Data breakpoints indexed by data id.
+
+    Data ids are valid only within one adapter session, so the store is cleared on reconnect.
+    """
+    def __init__(self):
+        _KeyedBreakpointStore.__init__(self, lambda breakpoint: breakpoint.data_id, _data_sync_key)
+
+
+def _source_mtime(source):
+    try:
+        return os.path.getmtime(source)
+    except (OSError, TypeError):
+        return None
+
+
+def save_breakpoints(path, breakpoints, function_breakpoints=()):
+    """
+    Saves line breakpoints grouped by source, together with modification time of each source,
+    and function breakpoints into compact json file.
+    """
+    sources = {}
+    for source in breakpoints.get_sources():
+        # plain line breakpoints are stored as lines only, others with their options
+        lines = []
+        options = []
+        for b in breakpoints.get_source_breakpoints(source):
+            if b.condition is None and b.hit_condition is None and b.log_message is None:
+                lines.append(b.line)
+            else:
+                options.append([b.line, b.condition, b.hit_condition, b.log_message])
+
+        sources[source] = {"mtime": _source_mtime(source), "lines": lines, "options": options}
+
+    data = {
+        "version": BREAKPOINTS_FILE_VERSION,
+        "sources": sources,
+        "functions": [[b.name, b.condition, b.hit_condition] for b in function_breakpoints]
+    }
+
+    with open(path, "wb") as f:
+        f.write(to_raw(json.dumps(data, separators=(",", ":"))))
+
+
+def read_breakpoints(path, skip_modified=False):
+    """
+    Reads file written by save_breakpoints.
+
+    Returns (breakpoints, function_breakpoints, modified_sources) where modified_sources lists
+    sources whose modification time differs from the saved one, so their lines may be off.
+    Breakpoints of modified sources are left out if skip_modified is set.
+    """
+    with open(path, "rb") as f:
+        data = json.loads(to_str(f.read()))
+
+    if data.get("version") != BREAKPOINTS_FILE_VERSION:
+        raise ValueError("unsupported breakpoints file version %s" % (data.get("version"),))
+
+    breakpoints = []
+    modified_sources = []
+    for source, entry in data["sources"].items():
+        if _source_mtime(source) != entry["mtime"]:
+            modified_sources.append(source)
+            if skip_modified:
+                continue
+        for line in entry["lines"]:
+            breakpoints.append(Breakpoint(line, source))
+        for line, condition, hit_condition, log_message in entry["options"]:
+            breakpoints.append(Breakpoint(line, source, condition, hit_condition, log_message))
+
+    function_breakpoints = [FunctionBreakpoint(name, condition, hit_condition)
+                            for name, condition, hit_condition in data["functions"]]
+
+    return breakpoints, function_breakpoints, modified_sources
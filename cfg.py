@@ -0,0 +1,310 @@
+# py23 compatible
+from __future__ import print_function
+from __future__ import division
+from __future__ import unicode_literals
+from __future__ import absolute_import
+
+import bisect
+import heapq
+from array import array
+
+from opcode import opmap
+
+from . import dis as _dis
+from .dis import _DecodeCache, _HASJABS, _HASJREL, _jump_target, _next_offset, _table
+
+# control flow graph of code objects
+
+
+def _names_table(names):
+    return _table([opmap[name] for name in names if name in opmap])
+
+
+# instructions that never continue with next instruction
+_UNCONDITIONAL_JUMP = _names_table(("JUMP_FORWARD", "JUMP_ABSOLUTE", "JUMP_BACKWARD",
+                                    "JUMP_BACKWARD_NO_INTERRUPT", "JUMP", "JUMP_NO_INTERRUPT",
+                                    "CONTINUE_LOOP", "BREAK_LOOP"))
+_NO_SUCCESSOR = _names_table(("RETURN_VALUE", "RETURN_CONST", "RAISE_VARARGS", "RERAISE"))
+
+# python < 3.11 block stack, BREAK_LOOP jumps to the exit of innermost SETUP_LOOP (python < 3.8),
+# other SETUP_* blocks protect instructions until their POP_BLOCK with handler at their jump target
+_SETUP_BLOCK = _names_table(("SETUP_LOOP", "SETUP_EXCEPT", "SETUP_FINALLY", "SETUP_WITH", "SETUP_ASYNC_WITH"))
+_SETUP_LOOP = opmap.get("SETUP_LOOP", -1)
+_POP_BLOCK = opmap.get("POP_BLOCK", -1)
+_BREAK_LOOP = opmap.get("BREAK_LOOP", -1)
+_HAS_BLOCK_STACK = 0 <= _POP_BLOCK < 256  # python 3.12+ lists POP_BLOCK only as pseudo instruction
+
+
+def _parse_varint(iterator):
+    b = next(iterator)
+    value = b & 63
+    while b & 64:
+        value <<= 6
+        b = next(iterator)
+        value |= b & 63
+    return value
+
+
+def _exception_table(co):
+    """
+    returns list of (start, end, handler) offsets of python 3.11+ exception table
+    """
+
+    entries = []
+    table = getattr(co, "co_exceptiontable", None)
+    if not table:
+        return entries
+    iterator = iter(bytearray(table))
+    try:
+        while True:
+            start = _parse_varint(iterator) * 2
+            end = start + _parse_varint(iterator) * 2
+            handler = _parse_varint(iterator) * 2
+            _parse_varint(iterator)  # stack depth and lasti flag
+            entries.append((start, end, handler))
+    except StopIteration:
+        return entries
+
+
+class BasicBlock(object):
+    """
+    instructions start:end (indexes into Instructions) executed in sequence
+    """
+
+    def __init__(self, index, start, end, start_offset, end_offset):
+        self.index = index
+        self.start = start
+        self.end = end
+        self.start_offset = start_offset
+        self.end_offset = end_offset
+        self.successors = []
+        self.predecessors = []
+        self.lines = []
+
+
+class ControlFlowGraph(object):
+    """
+    basic blocks of code object with successors and predecessors
+
+    blocks start at jump targets, exception handlers and after jumps or instructions ending the block,
+    exception handlers are successors of every block in their protected range
+    """
+
+    def __init__(self, co):
+        self.instructions, self.labels = _dis._cache.get(co, _dis._load)
+        self.line_table = _dis.get_line_table(co)
+        self.blocks = []
+        self.block_offsets = array(str("i"))
+        self._build(_exception_table(co))
+
+    def _build(self, handlers):
+        instructions = self.instructions
+        offsets = instructions.offsets
+        opcodes = instructions.opcodes
+        args = instructions.args
+        n = len(offsets)
+        if not n:
+            return
+
+        leaders = bytearray(n)
+        leaders[0] = 1
+        targets = array(str("i"), [-1]) * n
+        for k in range(n):
+            op = opcodes[k]
+            if _HASJREL[op] or _HASJABS[op]:
+                target = instructions.find(_jump_target(op, args[k], _next_offset(op, offsets[k])))
+                if target >= 0:
+                    leaders[target] = 1
+                    targets[k] = target
+                if k + 1 < n:
+                    leaders[k + 1] = 1
+            elif (_NO_SUCCESSOR[op] or op == _BREAK_LOOP) and k + 1 < n:
+                leaders[k + 1] = 1
+
+        # blocks also start where protecting handler changes, so code after protected range does not reach it
+        block_handlers = array(str("i"), [-1]) * n
+        if _HAS_BLOCK_STACK:
+            self._walk_blocks(targets, block_handlers)
+            for k in range(n):
+                if opcodes[k] == _BREAK_LOOP and targets[k] >= 0:
+                    leaders[targets[k]] = 1
+                if k > 0 and block_handlers[k] != block_handlers[k - 1]:
+                    leaders[k] = 1
+
+        handler_edges = []
+        for start, end, handler in handlers:
+            target = instructions.find(handler)
+            if target >= 0:
+                leaders[target] = 1
+                handler_edges.append((start, end, target))
+                for boundary in (start, end):
+                    k = bisect.bisect_left(offsets, boundary)
+                    if k < n:
+                        leaders[k] = 1
+
+        block_of = array(str("i"), [0]) * n
+        start = 0
+        for k in range(1, n + 1):
+            if k == n or leaders[k]:
+                index = len(self.blocks)
+                end_offset = offsets[k] if k < n else _next_offset(opcodes[k - 1], offsets[k - 1])
+                self.blocks.append(BasicBlock(index, start, k, offsets[start], end_offset))
+                self.block_offsets.append(offsets[start])
+                for i in range(start, k):
+                    block_of[i] = index
+                start = k
+
+        for block in self.blocks:
+            last = block.end - 1
+            op = opcodes[last]
+            successors = []
+            if targets[last] >= 0:
+                successors.append(block_of[targets[last]])
+            if not (_UNCONDITIONAL_JUMP[op] or _NO_SUCCESSOR[op]) and block.end < n:
+                successors.append(block.index + 1)
+            for k in range(block.start, block.end):
+                if block_handlers[k] >= 0:
+                    successors.append(block_of[block_handlers[k]])
+            block.successors = successors
+
+        for start, end, target in handler_edges:
+            handler = block_of[target]
+            k = max(bisect.bisect_right(self.block_offsets, start) - 1, 0)
+            while k < len(self.blocks) and self.blocks[k].start_offset < end:
+                if handler not in self.blocks[k].successors:
+                    self.blocks[k].successors.append(handler)
+                k += 1
+
+        for block in self.blocks:
+            block.successors = sorted(set(block.successors))
+            for successor in block.successors:
+                self.blocks[successor].predecessors.append(block.index)
+            block.lines = self._lines(block.start, block.end)
+
+    def _walk_blocks(self, targets, block_handlers):
+        """
+        follows python < 3.11 block stack along control flow
+
+        sets targets of BREAK_LOOP and block_handlers to handler index of innermost SETUP_* block
+        other than loop protecting each instruction
+        """
+        opcodes = self.instructions.opcodes
+        n = len(opcodes)
+        # tuple of (opcode, target index) of SETUP_* blocks entered, None for instructions not reached yet
+        stacks = [None] * n
+        stacks[0] = ()
+        # lowest index first, so loop start is reached by fall through before CONTINUE_LOOP jumps to it
+        pending = [0]
+        while pending:
+            k = heapq.heappop(pending)
+            stack = stacks[k]
+            op = opcodes[k]
+            for setup, target in reversed(stack):
+                if setup != _SETUP_LOOP:
+                    block_handlers[k] = target
+                    break
+
+            successors = []
+            next_stack = stack
+            if _SETUP_BLOCK[op]:
+                # handler or loop exit runs with the block already popped
+                successors.append((targets[k], stack))
+                next_stack = stack + ((op, targets[k]),)
+            elif op == _POP_BLOCK:
+                next_stack = stack[:-1]
+            elif op == _BREAK_LOOP:
+                for depth in range(len(stack) - 1, -1, -1):
+                    if stack[depth][0] == _SETUP_LOOP:
+                        targets[k] = stack[depth][1]
+                        successors.append((targets[k], stack[:depth]))
+                        break
+            elif targets[k] >= 0:
+                successors.append((targets[k], stack))
+            if not (_UNCONDITIONAL_JUMP[op] or _NO_SUCCESSOR[op]) and k + 1 < n:
+                successors.append((k + 1, next_stack))
+
+            for index, successor_stack in successors:
+                if index >= 0 and stacks[index] is None:
+                    stacks[index] = successor_stack
+                    heapq.heappush(pending, index)
+
+    def _lines(self, start, end):
+        """
+        returns sorted lines of instructions start:end
+        """
+        lines = set()
+        first = self.line_table.get_line(self.instructions.offsets[start])
+        if first is not None:
+            lines.add(first)
+        column = self.instructions.lines
+        for k in range(start + 1, end):
+            if column[k] >= 0:
+                lines.add(column[k])
+        return sorted(lines)
+
+    def get_blocks(self):
+        """
+        returns list of BasicBlock ordered by offset
+        """
+        return self.blocks
+
+    def get_block(self, offset):
+        """
+        returns BasicBlock containing offset or None
+        """
+        k = bisect.bisect_right(self.block_offsets, offset) - 1
+        if k < 0 or offset >= self.blocks[k].end_offset:
+            return None
+        return self.blocks[k]
+
+    def get_reachable_blocks(self, offset):
+        """
+        returns list of BasicBlock reachable from block containing offset (excluding it unless in loop)
+        """
+        block = self.get_block(offset)
+        if block is None:
+            return []
+
+        visited = bytearray(len(self.blocks))
+        reachable = []
+        stack = list(block.successors)
+        while stack:
+            index = stack.pop()
+            if visited[index]:
+                continue
+            visited[index] = 1
+            reachable.append(self.blocks[index])
+            stack.extend(self.blocks[index].successors)
+        return reachable
+
+    def get_reachable_lines(self, offset):
+        """
+        returns sorted list of lines that can be executed from instruction at offset on
+        """
+        block = self.get_block(offset)
+        if block is None:
+            return []
+
+        offsets = self.instructions.offsets
+        here = max(bisect.bisect_right(offsets, offset) - 1, block.start)
+        lines = set(self._lines(here, block.end))
+        for reachable in self.get_reachable_blocks(offset):
+            lines.update(reachable.lines)
+        return sorted(lines)
+
+
+_cfg_cache = _DecodeCache(_dis.DECODE_CACHE_SIZE)
+
+
+def get_cfg(co):
+    """
+    returns cached ControlFlowGraph of code object
+    """
+    return _cfg_cache.get(co, ControlFlowGraph)
+
+
+def clear_cache():
+    """
+    drops all cached control flow graphs
+    """
+    _cfg_cache.clear()
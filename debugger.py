@@ -9,8 +9,10 @@ import time
 import socket
 import traceback
 
-from collections import OrderedDict
+from collections import OrderedDict, deque, namedtuple
 
+from .breakpoints import Breakpoint, BreakpointStore, FunctionBreakpointStore, \
+    DataBreakpoint, DataBreakpointStore, _AccessType, save_breakpoints, read_breakpoints
 from .protocol import *
 from .utils import Counter
 
@@ -34,16 +36,47 @@ class StopReason(object):
     BREAKPOINT = 1
 
 
-class Breakpoint(object):
-    def __init__(self, line, source):
-        self.line = line
-        self.source = source
+# single output event received from the adapter, timestamp is time of receiving it
+OutputEntry = namedtuple("OutputEntry", ["timestamp", "category", "output", "source", "line"])
 
-    def __eq__(self, o):
-        return self.line == o.line and self.source == o.source
 
-    def __hash__(self):
-        return self.line.__hash__() ^ self.source.__hash__()
+class OutputBuffer(object):
+    """
+    Ring buffer of received output (including logpoint hits).
+
+    Reader thread only appends, consumers drain entries in batches. Relies on deque
+    append and popleft being atomic, so neither side takes a lock. When full,
+    oldest entries are dropped.
+    """
+    def __init__(self, capacity=65536):
+        self._entries = deque(maxlen=capacity)
+        self.received = 0
+        self.drained = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def append(self, entry):
+        self._entries.append(entry)
+        self.received += 1
+
+    def get_dropped(self):
+        """
+        Returns number of entries dropped because buffer was full
+        """
+        return self.received - self.drained - len(self._entries)
+
+    def drain(self, max_entries=None):
+        """
+        Removes and returns up to max_entries oldest entries (all if None)
+        """
+        batch = []
+        entries = self._entries
+        count = len(entries) if max_entries is None else min(max_entries, len(entries))
+        for _ in range(count):
+            batch.append(entries.popleft())
+        self.drained += len(batch)
+        return batch
 
 
 def _wait_cycle(return_method):
@@ -66,7 +99,7 @@ def _wait_cycle(return_method):
                 self = self.get_debugger()
 
             if callback is not None:
-                def wait_callback(request_id):
+                def wait_callback():
                     if pass_arg is not None:
                         callback(return_method(real_self, pass_arg))
                     else:
@@ -105,9 +138,24 @@ class RenpyDebugger(threading.Thread):
         self.stopped = False
 
         self.socket = None
+        # pause epoch changes whenever execution stops or continues, frame epoch of a thread also when its active
+        # frame changes, components remember epoch they were created in and are valid only while it is current
+        self.pause_epoch = 0
         self._cleanup()
-        self.breakpoints = set()
-        self.removed_breakpoints = set()
+        self.breakpoints = BreakpointStore()
+        self.function_breakpoints = FunctionBreakpointStore()
+        self.data_breakpoints = DataBreakpointStore()
+        self.exception_filters = None
+        self._exception_filters_dirty = False
+
+        # number of stack frames requested at once when paging through stack trace
+        self.stack_page_size = 20
+        # number of variables requested at once by VariableWindow and number of pages it keeps
+        self.variables_page_size = 100
+        self.variables_cached_pages = 16
+
+        # output events and logpoint hits
+        self.output = OutputBuffer()
 
         # initialize no op callbacks
         self.set_connected_callback()
@@ -117,6 +165,14 @@ class RenpyDebugger(threading.Thread):
 
         self._wait_callback = None
         self._request_lock = threading.Lock()
+        self._send_lock = threading.RLock()
+        self._breakpoint_lock = threading.RLock()
+
+        # breakpoint changes requested with sync=True within sync_delay seconds are sent at once
+        self.sync_delay = None
+        self._sync_timer = None
+        self._sync_deadline = 0
+        self._sync_lock = threading.Lock()
 
         self.start()
 
@@ -152,6 +208,7 @@ class RenpyDebugger(threading.Thread):
 
                         # initialization
                         if isinstance(message, DAPInitializeResponse):
+                            self._resolve_capabilities(message)
                             self._init_handshake2()
                         if isinstance(message, DAPInitializedEvent):
                             self._init_handshake3()
@@ -173,6 +230,20 @@ class RenpyDebugger(threading.Thread):
                             self._resolve_scopes(message)
                         if isinstance(message, DAPVariablesResponse):
                             self._resolve_variables(message)
+                        if isinstance(message, DAPSetBreakpointsResponse):
+                            self._resolve_set_breakpoints(message)
+                        if isinstance(message, DAPSetFunctionBreakpointsResponse):
+                            self._resolve_set_breakpoints(message)
+                        if isinstance(message, DAPSetDataBreakpointsResponse):
+                            self._resolve_set_breakpoints(message)
+                        if isinstance(message, DAPDataBreakpointInfoResponse):
+                            self._resolve_data_breakpoint_info(message)
+                        if isinstance(message, DAPExceptionInfoResponse):
+                            self._resolve_exception_info(message)
+                        if isinstance(message, DAPBreakpointEvent):
+                            self._resolve_breakpoint_event(message)
+                        if isinstance(message, DAPOutputEvent):
+                            self._resolve_output(message)
 
                         if isinstance(message, DAPResponse):
                             if message.get_request_seq() in self._requests:
@@ -200,14 +271,22 @@ class RenpyDebugger(threading.Thread):
         if self.state != DebuggerState.EXECUTION_PAUSED:
             raise RuntimeError("bad state")
 
+        self.flush_breakpoints()
+
         self.current_states = set()
+        self._next_epoch()
         self.state = DebuggerState.CONNECTED
 
+    def _next_epoch(self):
+        self.pause_epoch += 1
+
     def _cleanup(self):
         self.rq_counter = Counter()
         self._requests = {}
         self.state = DebuggerState.NOT_CONNECTED
         self.current_states = set()
+        self.capabilities = DAPCapabilities.create()
+        self._next_epoch()
 
         try:
             if self.socket is not None:
@@ -217,49 +296,128 @@ class RenpyDebugger(threading.Thread):
 
         self.socket = None
 
+    def _send(self, message):
+        with self._send_lock:
+            message.send(self.socket)
+
     def _send_request(self, waiter, request, request_id):
-        self._requests[request_id] = _MessageState(self._request_lock, request_id, waiter)
-        request.send(self.socket)
+        self._requests[request_id] = _MessageState(self._request_lock, request_id, waiter, request)
+        self._send(request)
 
     def _mk_breakpoints(self):
-        source_map = {}
-        for bk in self.breakpoints:
-            src = bk.source
-            line = bk.line
-            if src not in source_map:
-                source_map[src] = set()
-            source_map[src].add(line)
-
-        for bk in self.removed_breakpoints:
-            src = bk.source
-            line = bk.line
-            if src not in source_map:
-                source_map[src] = set()
-        self.removed_breakpoints.clear()
-
         breakpoint_requests = []
-        for source in source_map:
-            src = DAPSource.create(path=source)
+        # dirty source without breakpoints is sent with empty set to clear it
+        for source in self.breakpoints.pop_dirty_sources():
             bkpts = []
+            for bk in self.breakpoints.get_source_breakpoints(source):
+                sb = self._mk_source_breakpoint(bk)
+                if sb is not None:
+                    bkpts.append(sb)
 
-            for l in source_map[source]:
-                bkpts.append(DAPSourceBreakpoint.create(l))
+            if self.breakpoints.is_synced(source, bkpts):
+                continue  # these breakpoints were already sent
+            self.breakpoints.mark_sent(source, bkpts)
+
+            src = DAPSource.create(path=source)
 
             args = DAPSetBreakpointsArguments.create(src, bkpts)
             req = DAPSetBreakpointsRequest.create(self.rq_counter.get(), args)
 
-            breakpoint_requests.append(req)
+            breakpoint_requests.append((self.breakpoints, req))
+
+        if self.function_breakpoints.pop_dirty():
+            req = self._mk_function_breakpoints()
+            if req is not None:
+                breakpoint_requests.append((self.function_breakpoints, req))
+
+        if self.data_breakpoints.pop_dirty():
+            req = self._mk_data_breakpoints()
+            if req is not None:
+                breakpoint_requests.append((self.data_breakpoints, req))
+
+        if self._exception_filters_dirty:
+            self._exception_filters_dirty = False
+            filters = self.exception_filters
+            if filters is None:
+                filters = [f.get_filter() for f in self.get_exception_breakpoint_filters()
+                           if f.get_default_or_default(False)]
+            args = DAPSetExceptionBreakpointsArguments.create(filters)
+            req = DAPSetExceptionBreakpointsRequest.create(self.rq_counter.get(), args)
+            breakpoint_requests.append((None, req))
 
         return breakpoint_requests
 
+    def _mk_function_breakpoints(self):
+        if not self.capabilities.get_supports_function_breakpoints_or_default(False):
+            return None
+
+        bkpts = []
+        for fb in self.function_breakpoints:
+            bkpt = DAPFunctionBreakpoint.create(fb.name)
+            if fb.condition is not None and self.capabilities.get_supports_conditional_breakpoints_or_default(False):
+                bkpt.set_condition(fb.condition)
+            if fb.hit_condition is not None and self.capabilities.get_supports_hit_conditional_breakpoints_or_default(False):
+                bkpt.set_hit_condition(fb.hit_condition)
+            bkpts.append(bkpt)
+
+        if self.function_breakpoints.is_synced(bkpts):
+            return None  # these breakpoints were already sent
+        self.function_breakpoints.mark_sent(bkpts)
+
+        args = DAPSetFunctionBreakpointsArguments.create(bkpts)
+        return DAPSetFunctionBreakpointsRequest.create(self.rq_counter.get(), args)
+
+    def _mk_data_breakpoints(self):
+        if not self.capabilities.get_supports_data_breakpoints_or_default(False):
+            return None
+
+        bkpts = []
+        for db in self.data_breakpoints:
+            bkpt = DAPDataBreakpoint.create(db.data_id, access_type=_AccessType(db.access_type))
+            if db.condition is not None and self.capabilities.get_supports_conditional_breakpoints_or_default(False):
+                bkpt.set_condition(db.condition)
+            if db.hit_condition is not None and self.capabilities.get_supports_hit_conditional_breakpoints_or_default(False):
+                bkpt.set_hit_condition(db.hit_condition)
+            bkpts.append(bkpt)
+
+        if self.data_breakpoints.is_synced(bkpts):
+            return None  # these breakpoints were already sent
+        self.data_breakpoints.mark_sent(bkpts)
+
+        args = DAPSetDataBreakpointsArguments.create(bkpts)
+        return DAPSetDataBreakpointsRequest.create(self.rq_counter.get(), args)
+
+    def _mk_source_breakpoint(self, bk):
+        sb = DAPSourceBreakpoint.create(bk.line)
+
+        if bk.log_message is not None:
+            if not self.capabilities.get_supports_log_points_or_default(False):
+                return None  # logpoint must never stop the game, so it is not sent at all
+            sb.set_log_message(bk.log_message)
+
+        # conditions are only sent to adapters able to evaluate them, otherwise breakpoint is unconditional
+        if bk.condition is not None and self.capabilities.get_supports_conditional_breakpoints_or_default(False):
+            sb.set_condition(bk.condition)
+        if bk.hit_condition is not None and self.capabilities.get_supports_hit_conditional_breakpoints_or_default(False):
+            sb.set_hit_condition(bk.hit_condition)
+
+        return sb
+
     # internal resolve events
 
     def _resolve_stopped_event(self, event):
+        self._next_epoch()
         self.state = DebuggerState.EXECUTION_PAUSED
         stop_reason = event.get_body().get_reason()
         stop_description = event.get_body().get_description_or_default("")
-        res = RenpyExecutionState(self)
+        res = RenpyExecutionState(self, stop_reason, stop_description)
         self.current_states.add(res)
+
+        thread_id = event.get_body().get_thread_id_or_default(None)
+        if stop_reason == "exception" and thread_id is not None:
+            # exception is almost always inspected, so request it together with top of the stack
+            res._prefetch_exception(thread_id)
+
         self.pause_callback(stop_reason, stop_description, res)
 
     def _resolve_threads(self, response):
@@ -269,7 +427,7 @@ class RenpyDebugger(threading.Thread):
 
     def _resolve_stack_traces(self, response):
         request = self._requests[response.get_request_seq()]
-        request.waiter._load_stack_traces(response.get_body())
+        request.waiter._load_stack_traces(request.request, response.get_body())
         request.set_ready()
 
     def _resolve_scopes(self, response):
@@ -279,25 +437,77 @@ class RenpyDebugger(threading.Thread):
 
     def _resolve_variables(self, response):
         request = self._requests[response.get_request_seq()]
-        request.waiter._load_variables(response.get_body())
+        request.waiter._load_variables(request.request, response.get_body())
+        request.set_ready()
+
+    def _resolve_output(self, event):
+        body = event.get_body()
+        source = None
+        if body.has_source():
+            source = body.get_source().get_path_or_default(None)
+        self.output.append(OutputEntry(time.time(), body.get_category_or_default("console"),
+                                       body.get_output(), source, body.get_line_or_default(None)))
+
+    def _resolve_data_breakpoint_info(self, response):
+        request = self._requests[response.get_request_seq()]
+        request.waiter._load_data_breakpoint_info(response.get_body())
+        request.set_ready()
+
+    def _resolve_exception_info(self, response):
+        request = self._requests[response.get_request_seq()]
+        request.waiter._load_exception_info(response.get_body())
         request.set_ready()
 
+    def _resolve_capabilities(self, response):
+        self.capabilities = response.get_body_or_default(None) or DAPCapabilities.create()
+
+    def _resolve_set_breakpoints(self, response):
+        request = self._requests[response.get_request_seq()]
+        with self._breakpoint_lock:
+            request.waiter._load_breakpoints(request.request, response.get_body())
+        request.set_ready()
+
+    def _resolve_breakpoint_event(self, event):
+        body = event.get_body()
+        bp = body.get_breakpoint()
+        with self._breakpoint_lock:
+            if bp.has_id():
+                for store in (self.breakpoints, self.function_breakpoints, self.data_breakpoints):
+                    if store.get_by_adapter_id(bp.get_id()) is not None:
+                        store._load_breakpoint_event(body)
+                        return
+            # id unknown to every store, line breakpoint may still be found by its source and line
+            self.breakpoints._load_breakpoint_event(body)
+
     def _init_handshake1(self):
         self.state = DebuggerState.CONNECTING
 
         request_id = self.rq_counter.get()
-        DAPInitializeRequest.create(request_id, DAPInitializeRequestArguments.create(0)).send(self.socket)
+        # windows and expansion request variables with filter/start/count
+        self._send(DAPInitializeRequest.create(request_id, DAPInitializeRequestArguments.create(
+            0, supports_variable_paging=True)))
 
     def _init_handshake2(self):
+        # fresh connection, adapter knows no breakpoints
+        with self._breakpoint_lock:
+            self.breakpoints.reset_adapter_state()
+            self.breakpoints.mark_all_dirty()
+            self.function_breakpoints.reset_adapter_state()
+            self.function_breakpoints.mark_all_dirty()
+            # data ids of previous session are meaningless to the new adapter
+            self.data_breakpoints.clear()
+            self.data_breakpoints.reset_adapter_state()
+            self.data_breakpoints.pop_dirty()
+            self._exception_filters_dirty = self.exception_filters is not None
         self.sync_breakpoints()
 
         request_id = self.rq_counter.get()
-        DAPConfigurationDoneRequest.create(request_id).send(self.socket)
+        self._send(DAPConfigurationDoneRequest.create(request_id))
 
     def _init_handshake3(self):
         self.state = DebuggerState.CONNECTED
         request_id = self.rq_counter.get()
-        DAPLaunchRequest.create(request_id, DAPLaunchRequestArguments.create()).send(self.socket)
+        self._send(DAPLaunchRequest.create(request_id, DAPLaunchRequestArguments.create()))
 
     def _connected(self):
         self.connected_callback()
@@ -317,18 +527,24 @@ class RenpyDebugger(threading.Thread):
         if self.state == DebuggerState.NOT_CONNECTED:
             raise RuntimeError("already disconnected")
 
-        DAPDisconnectRequest.create(self.rq_counter.get()).send(self.socket)
+        self._send(DAPDisconnectRequest.create(self.rq_counter.get()))
 
     def pause(self):
         if self.state != DebuggerState.CONNECTED:
             raise RuntimeError("already connected")
 
         # TODO?
-        DAPPauseRequest.create(self.rq_counter.get(), DAPPauseArguments.create(0)).send(self.socket)
+        self._send(DAPPauseRequest.create(self.rq_counter.get(), DAPPauseArguments.create(0)))
 
     def get_state(self):
         return self.state
 
+    def get_capabilities(self):
+        """
+        Returns DAPCapabilities reported by the adapter
+        """
+        return self.capabilities
+
     # callbacks
 
     def set_connected_callback(self, callback=lambda: None):
@@ -346,43 +562,294 @@ class RenpyDebugger(threading.Thread):
     # breakpoints related
 
     def add_breakpoint(self, breakpoint, sync=False):
-        self.breakpoints.add(breakpoint)
+        with self._breakpoint_lock:
+            self.breakpoints.add(breakpoint)
 
         if sync:
-            self.sync_breakpoints()
+            self._request_sync()
+
+    def add_breakpoints(self, breakpoints, sync=False):
+        """
+        Adds many breakpoints in one bulk operation
+        """
+        with self._breakpoint_lock:
+            self.breakpoints.add_many(breakpoints)
+
+        if sync:
+            self._request_sync()
 
     def remove_breakpoint(self, breakpoint, sync=False):
-        self.breakpoints.remove(breakpoint)
-        self.removed_breakpoints.add(breakpoint)
+        with self._breakpoint_lock:
+            self.breakpoints.remove(breakpoint)
 
         if sync:
-            self.sync_breakpoints()
+            self._request_sync()
 
     def remove_breakpoint_from_source(self, source, sync=False):
-        to_remove = set()
+        with self._breakpoint_lock:
+            self.breakpoints.remove_source(source)
+
+        if sync:
+            self._request_sync()
 
-        for b in self.breakpoints:
-            if b.source == source:
-                to_remove.add(b)
+    def add_logpoint(self, line, source, log_message, condition=None, hit_condition=None, sync=False):
+        """
+        Adds logpoint, which emits log_message into output instead of stopping
+        """
+        breakpoint = Breakpoint(line, source, condition, hit_condition, log_message)
+        self.add_breakpoint(breakpoint, sync=sync)
+        return breakpoint
 
-        for b in to_remove:
-            self.remove_breakpoint(breakpoint, sync=False)
+    def add_function_breakpoint(self, breakpoint, sync=False):
+        with self._breakpoint_lock:
+            self.function_breakpoints.add(breakpoint)
 
         if sync:
-            self.sync_breakpoints()
+            self._request_sync()
+
+    def remove_function_breakpoint(self, name, sync=False):
+        with self._breakpoint_lock:
+            self.function_breakpoints.remove(name)
+
+        if sync:
+            self._request_sync()
+
+    def clear_function_breakpoints(self, sync=False):
+        with self._breakpoint_lock:
+            self.function_breakpoints.clear()
+
+        if sync:
+            self._request_sync()
+
+    def add_data_breakpoint(self, breakpoint, sync=False):
+        with self._breakpoint_lock:
+            self.data_breakpoints.add(breakpoint)
+
+        if sync:
+            self._request_sync()
+
+    def remove_data_breakpoint(self, data_id, sync=False):
+        with self._breakpoint_lock:
+            self.data_breakpoints.remove(data_id)
+
+        if sync:
+            self._request_sync()
+
+    def clear_data_breakpoints(self, sync=False):
+        with self._breakpoint_lock:
+            self.data_breakpoints.clear()
+
+        if sync:
+            self._request_sync()
+
+    def drain_output(self, max_entries=None):
+        """
+        Returns batch of oldest received OutputEntry instances, removing them from output buffer
+        """
+        return self.output.drain(max_entries)
+
+    def get_exception_breakpoint_filters(self):
+        """
+        Returns DAPExceptionBreakpointsFilter list the adapter offers
+        """
+        return self.capabilities.get_exception_breakpoint_filters_or_default([])
+
+    def set_exception_breakpoints(self, filters, sync=False):
+        """
+        Sets which exceptions stop execution, by filter names from get_exception_breakpoint_filters.
+
+        None restores adapter defaults, filters the adapter marks as default.
+        """
+        if filters is not None and self.state != DebuggerState.NOT_CONNECTED:
+            available = set(f.get_filter() for f in self.get_exception_breakpoint_filters())
+            for f in filters:
+                if f not in available:
+                    raise ValueError("unknown exception filter %s" % f)
+
+        with self._breakpoint_lock:
+            # adapter starts with its defaults, so None needs to be sent only to replace earlier filters
+            self._exception_filters_dirty = filters is not None or self.exception_filters is not None
+            self.exception_filters = None if filters is None else list(filters)
+
+        if sync:
+            self._request_sync()
 
     def clear_breakpoints(self, sync=False):
-        self.breakpoints = set()
+        with self._breakpoint_lock:
+            self.breakpoints.clear()
+
+        if sync:
+            self._request_sync()
+
+    def save_breakpoints(self, path):
+        """
+        Saves line and function breakpoints to file, data breakpoints are bound to session and are not saved
+        """
+        with self._breakpoint_lock:
+            save_breakpoints(path, self.breakpoints, self.function_breakpoints)
+
+    def load_breakpoints(self, path, skip_modified=False, sync=False):
+        """
+        Adds breakpoints saved by save_breakpoints in bulk.
+
+        Returns list of sources modified since breakpoints were saved. Their breakpoints are
+        not loaded if skip_modified is set. If called before connect, they are all sent with initial sync.
+        """
+        breakpoints, function_breakpoints, modified_sources = read_breakpoints(path, skip_modified)
+
+        with self._breakpoint_lock:
+            self.breakpoints.add_many(breakpoints)
+            for breakpoint in function_breakpoints:
+                self.function_breakpoints.add(breakpoint)
 
         if sync:
+            self._request_sync()
+
+        return modified_sources
+
+    def set_sync_delay(self, delay=None):
+        """
+        Sets quiet window in seconds in which breakpoint changes made with sync=True are merged into single sync.
+
+        None means every such change is synced immediately.
+        """
+        self.sync_delay = delay
+
+    def _request_sync(self):
+        if self.sync_delay is None:
+            self.sync_breakpoints()
+            return
+
+        with self._sync_lock:
+            # single timer is running at a time, later changes only push its deadline back
+            self._sync_deadline = time.time() + self.sync_delay
+            if self._sync_timer is None:
+                self._start_sync_timer(self.sync_delay)
+
+    def _start_sync_timer(self, delay):
+        self._sync_timer = threading.Timer(delay, self._delayed_sync)
+        self._sync_timer.daemon = True
+        self._sync_timer.start()
+
+    def _delayed_sync(self):
+        with self._sync_lock:
+            if self._sync_timer is not threading.current_thread():
+                return  # cancelled by flush_breakpoints
+            remaining = self._sync_deadline - time.time()
+            if remaining > 0:
+                self._start_sync_timer(remaining)
+                return
+            self._sync_timer = None
+
+        if self.state != DebuggerState.NOT_CONNECTED:
+            self.sync_breakpoints()
+
+    def flush_breakpoints(self):
+        """
+        Cancels pending delayed sync and syncs changed breakpoints immediately, if connected
+        """
+        with self._sync_lock:
+            if self._sync_timer is not None:
+                self._sync_timer.cancel()
+                self._sync_timer = None
+
+        if self.state != DebuggerState.NOT_CONNECTED:
             self.sync_breakpoints()
 
     def sync_breakpoints(self):
+        """
+        Sends breakpoints of sources that changed since last sync and function, data and exception breakpoints,
+        if they changed
+        """
         if self.state == DebuggerState.NOT_CONNECTED:
             raise RuntimeError("not connected")
 
-        for breakpoint_request in self._mk_breakpoints():
-            breakpoint_request.send(self.socket)
+        with self._send_lock:
+            with self._breakpoint_lock:
+                breakpoint_requests = self._mk_breakpoints()
+
+            for store, breakpoint_request in breakpoint_requests:
+                self._send_request(store, breakpoint_request, breakpoint_request.get_seq())
+
+
+def _request_wave(containers, concurrency, counts=None):
+    """
+    Requests components of all containers, at most concurrency requests in flight at once,
+    and waits until every response of the wave is loaded.
+
+    counts, if given, caps number of components requested for each container.
+    """
+    if len(containers) == 0:
+        return
+
+    debugger = containers[0].get_debugger()
+
+    for i in range(0, len(containers), concurrency):
+        wave = containers[i:i + concurrency]
+        done = threading.Event()
+        remaining = [len(wave)]
+        lock = threading.Lock()
+
+        def wave_callback():
+            with lock:
+                remaining[0] -= 1
+                finished = remaining[0] == 0
+            if finished:
+                done.set()
+
+        states = []
+        for j, container in enumerate(wave):
+            if not container.is_valid():
+                raise RuntimeError("%s is not valid!" % (repr(container)))
+            count = counts[i + j] if counts is not None else None
+            states.append(debugger._requests[container._request_components(count)])
+        for state in states:
+            state.set_callback(wave_callback)
+        done.wait()
+
+
+def _expand_containers(containers, depth, max_nodes, concurrency):
+    """
+    Loads children of containers level by level up to depth levels.
+
+    All variables requests of a level are sent in one wave, leaves are skipped.
+    Each request is capped by count (start/count), so at most max_nodes variables are loaded.
+    """
+    level = list(containers)
+    nodes = 0
+
+    for _ in range(depth):
+        # containers with counts reported by the adapter get them first,
+        # rest of the budget is split evenly among containers with unknown counts
+        candidates = [c for c in level if c.var_ref != 0]
+        budget = max_nodes - nodes
+        allotted = {}
+        for container in candidates:
+            known = container.indexed + container.named
+            if known > 0 and budget > 0:
+                allotted[id(container)] = min(budget, known)
+                budget -= allotted[id(container)]
+        unknown = [c for c in candidates if c.indexed + c.named == 0]
+        if unknown and budget > 0:
+            share = max(budget // len(unknown), 1)
+            for container in unknown:
+                if budget <= 0:
+                    break
+                allotted[id(container)] = min(share, budget)
+                budget -= allotted[id(container)]
+
+        pending = [c for c in candidates if id(c) in allotted]
+        counts = [allotted[id(c)] for c in pending]
+        if len(pending) == 0:
+            break
+
+        _request_wave(pending, concurrency, counts)
+
+        level = []
+        for container in pending:
+            for child in container.variables.values():
+                nodes += 1
+                level.append(child)
 
 
 class _DebuggerComponent(object):
@@ -393,10 +860,7 @@ class _DebuggerComponent(object):
         """
         Returns actual top level debugger instance from nested component instances
         """
-        if isinstance(self.debugger, RenpyDebugger):
-            return self.debugger
-        else:
-            return self.debugger.get_debugger()
+        return self.debugger
 
 
 class RenpyExecutionState(_DebuggerComponent):
@@ -407,12 +871,25 @@ class RenpyExecutionState(_DebuggerComponent):
     """
     # TODO: work around real multithreading debugging both in renpy and here, so far it can't be done because renpy doesn't support it
     # so w/e
-    def __init__(self, debugger):
+    def __init__(self, debugger, stop_reason=None, stop_description=None):
         self.debugger = debugger
+        self.epoch = debugger.pause_epoch
+        self.stop_reason = stop_reason
+        self.stop_description = stop_description
         self.threads = {}
 
+        self.exception_thread_id = None
+        self.exception_info = None
+        self._exception_request_id = None
+
+    def get_stop_reason(self):
+        return self.stop_reason
+
+    def get_stop_description(self):
+        return self.stop_description
+
     def is_valid(self):
-        return self in self.debugger.current_states
+        return self.epoch == self.debugger.pause_epoch
 
     def _get_threads(self):
         return list(self.threads.values())
@@ -426,9 +903,59 @@ class RenpyExecutionState(_DebuggerComponent):
         return request_id
 
     def _load_threads(self, rb):
-        self.threads = {}
-        for thread_id in rb.get_threads():
-            self.threads[thread_id] = RenpyThread(self, thread_id)
+        threads = {}
+        for thread in rb.get_threads():
+            if thread.get_id() in self.threads:
+                # keep thread created by prefetch, with its stack trace
+                threads[thread.get_id()] = self.threads[thread.get_id()]
+                threads[thread.get_id()].name = thread.get_name()
+            else:
+                threads[thread.get_id()] = RenpyThread(self, thread)
+        self.threads = threads
+
+    def _prefetch_exception(self, thread_id):
+        self.exception_thread_id = thread_id
+
+        thread = RenpyThread(self, DAPThread.create(thread_id, ""))
+        self.threads[thread_id] = thread
+        thread._request_stack_frames(self.debugger.stack_page_size)
+
+        if self.debugger.capabilities.get_supports_exception_info_request_or_default(False):
+            self._request_exception_info()
+
+    def _get_exception_info(self, thread_id=None):
+        return self.exception_info
+
+    @_wait_cycle(_get_exception_info)
+    def _load_exception_info_of(self, thread_id):
+        if self._exception_request_id is None:
+            if not self.debugger.capabilities.get_supports_exception_info_request_or_default(False):
+                raise RuntimeError("adapter does not support exception info")
+            if thread_id is not None:
+                self.exception_thread_id = thread_id
+            if self.exception_thread_id is None:
+                raise RuntimeError("unknown thread of the exception")
+            self._request_exception_info()
+        return self._exception_request_id
+
+    def get_exception_info(self, thread_id=None, callback=None):
+        """
+        Returns DAPExceptionInfoResponseBody of exception execution stopped on.
+
+        If stop was caused by exception, it was already requested together with the stack trace.
+        Raises RuntimeError if adapter does not support exceptionInfo request.
+        """
+        return self._load_exception_info_of(thread_id, callback, thread_id=thread_id)
+
+    def _request_exception_info(self):
+        request_id = self.debugger.rq_counter.get()
+
+        request = DAPExceptionInfoRequest.create(request_id, DAPExceptionInfoArguments.create(self.exception_thread_id))
+        self.debugger._send_request(self, request, request_id)
+        self._exception_request_id = request_id
+
+    def _load_exception_info(self, rb):
+        self.exception_info = rb
 
 
 class RenpyThread(_DebuggerComponent):
@@ -440,12 +967,15 @@ class RenpyThread(_DebuggerComponent):
 
     def __init__(self, execution_state, thread):
         self.debugger = execution_state.get_debugger()
+        self.epoch = self.debugger.pause_epoch
         self.execution_state = execution_state
         self.thread_id = thread.get_id()
         self.name = thread.get_name()
 
         self.stack_trace = None
+        self._stack_request_id = None
         self.active_frame = None
+        self.frame_epoch = 0
 
     def get_thread_id(self):
         return self.thread_id
@@ -454,44 +984,140 @@ class RenpyThread(_DebuggerComponent):
         return self.name
 
     def is_valid(self):
-        return self.execution_state.is_valid() and self.debugger.get_state() == DebuggerState.EXECUTION_PAUSED
+        return self.epoch == self.debugger.pause_epoch
 
-    def _get_stack_frames(self):
+    def _get_stack_frames(self, levels=None):
         return self.stack_trace
 
     @_wait_cycle(_get_stack_frames)
-    def get_stack_frames(self):
-        request_id = self.debugger.rq_counter.get()
+    def _load_stack_frames(self, levels):
+        if self._stack_request_id is None:
+            self._request_stack_frames(levels)
+        return self._stack_request_id
 
-        request = DAPStackTraceRequest.create(request_id, DAPStackTraceArguments.create(self.thread_id))
-        self.debugger._send_request(self, request, request_id)
-        return request_id
+    def get_stack_frames(self, levels=1, callback=None):
+        """
+        Returns lazy sequence of stack frames of this thread.
+
+        Only first levels frames are requested, rest is loaded in pages when indexed or iterated
+        (adapters without delayed stack trace loading send whole stack at once).
+        Stack does not change while paused, so it is requested only once.
+        """
+        return self._load_stack_frames(levels, callback, levels=levels)
 
-    def _load_stack_traces(self, rb):
-        self.stack_trace = []
-        for stack_frame in rb.get_stack_frames():
-            self.stack_trace.append(StackFrame(self, stack_frame))
+    def _request_stack_frames(self, levels):
+        self.stack_trace = StackTrace(self)
+        self._stack_request_id = self.stack_trace._request_frames(0, levels)
 
     def _set_active_frame(self, frame):
         if self.active_frame is not None:
             self.active_frame._clear()
+        if self.active_frame is not frame:
+            # variables of previously active frame of this thread are no longer valid
+            self.frame_epoch += 1
         self.active_frame = frame
 
     def continue_execution(self):
         self.debugger._continue_with_the_execution()
-        DAPContinueRequest.create(self.debugger.rq_counter.get(), DAPContinueArguments.create(self.thread_id)).send(self.debugger.socket)
+        self.debugger._send(DAPContinueRequest.create(self.debugger.rq_counter.get(), DAPContinueArguments.create(self.thread_id)))
 
     def step(self):
         self.debugger._continue_with_the_execution()
-        DAPNextRequest.create(self.debugger.rq_counter.get(), DAPNextArguments.create(self.thread_id)).send(self.debugger.socket)
+        self.debugger._send(DAPNextRequest.create(self.debugger.rq_counter.get(), DAPNextArguments.create(self.thread_id)))
 
     def step_in(self):
         self.debugger._continue_with_the_execution()
-        DAPStepInRequest.create(self.debugger.rq_counter.get(), DAPStepInArguments.create(self.thread_id)).send(self.debugger.socket)
+        self.debugger._send(DAPStepInRequest.create(self.debugger.rq_counter.get(), DAPStepInArguments.create(self.thread_id)))
 
     def step_out(self):
         self.debugger._continue_with_the_execution()
-        DAPStepOutRequest.create(self.debugger.rq_counter.get(), DAPStepOutArguments.create(self.thread_id)).send(self.debugger.socket)
+        self.debugger._send(DAPStepOutRequest.create(self.debugger.rq_counter.get(), DAPStepOutArguments.create(self.thread_id)))
+
+
+class StackTrace(_DebuggerComponent):
+    """
+    Lazy sequence of stack frames of paused thread.
+
+    Frames are requested in pages (startFrame/levels) only when they are accessed,
+    if adapter supports delayed stack trace loading, otherwise whole stack is requested at once.
+    """
+    def __init__(self, rpy_thread):
+        self.debugger = rpy_thread.get_debugger()
+        self.epoch = self.debugger.pause_epoch
+        self.rpy_thread = rpy_thread
+        self.frames = {}
+        self.total_frames = None
+
+    def is_valid(self):
+        return self.epoch == self.debugger.pause_epoch
+
+    def _request_frames(self, start, levels):
+        request_id = self.debugger.rq_counter.get()
+
+        arguments = DAPStackTraceArguments.create(self.rpy_thread.thread_id)
+        if self.debugger.capabilities.get_supports_delayed_stack_trace_loading_or_default(False):
+            arguments.set_start_frame(start).set_levels(levels)
+        # otherwise adapter may ignore startFrame/levels, so whole stack is requested at once
+
+        request = DAPStackTraceRequest.create(request_id, arguments)
+        self.debugger._send_request(self, request, request_id)
+        return request_id
+
+    def _get_self(self):
+        return self
+
+    @_wait_cycle(_get_self)
+    def _load_page(self, start, levels=None):
+        return self._request_frames(start, levels or self.debugger.stack_page_size)
+
+    def _load_stack_traces(self, rq, rb):
+        arguments = rq.get_arguments()
+        start = arguments.get_start_frame_or_default(0)
+        levels = arguments.get_levels_or_default(0)
+
+        stack_frames = rb.get_stack_frames()
+        for i, stack_frame in enumerate(stack_frames):
+            self.frames[start + i] = StackFrame(self.rpy_thread, stack_frame)
+
+        total_frames = rb.get_total_frames_or_default(None)
+        if levels == 0 or len(stack_frames) < levels:
+            # whole stack requested or fewer frames than requested means there are no more
+            total_frames = start + len(stack_frames)
+        if total_frames is not None:
+            self.total_frames = total_frames
+
+    def _ensure_frame(self, index):
+        if index not in self.frames:
+            if self.total_frames is not None and index >= self.total_frames:
+                return False
+            # page stops at first loaded frame, so loaded frames are never replaced
+            levels = self.debugger.stack_page_size
+            loaded = [i for i in self.frames if i > index]
+            if loaded:
+                levels = min(levels, min(loaded) - index)
+            self._load_page(start=index, levels=levels)
+        return index in self.frames
+
+    def __len__(self):
+        while self.total_frames is None:
+            self._load_page(start=max(self.frames) + 1 if self.frames else 0)
+        return self.total_frames
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        if index < 0:
+            index += len(self)
+        if index < 0 or not self._ensure_frame(index):
+            raise IndexError("stack frame index out of range")
+        return self.frames[index]
+
+    def __iter__(self):
+        index = 0
+        while self._ensure_frame(index):
+            yield self.frames[index]
+            index += 1
 
 
 class StackFrame(_DebuggerComponent):
@@ -502,6 +1128,7 @@ class StackFrame(_DebuggerComponent):
     """
     def __init__(self, rpy_thread, stack_frame):
         self.debugger = rpy_thread.get_debugger()
+        self.epoch = self.debugger.pause_epoch
         self.rpy_thread = rpy_thread
         self.stack_frame = stack_frame
         self.scopes = None
@@ -510,7 +1137,7 @@ class StackFrame(_DebuggerComponent):
         self.scopes = None
 
     def is_valid(self):
-        return self.rpy_thread.is_valid() and self.rpy_thread.active_frame == self
+        return self.epoch == self.debugger.pause_epoch and self.rpy_thread.active_frame is self
 
     def get_line_of_code(self):
         return self.stack_frame.get_name()
@@ -541,13 +1168,23 @@ class StackFrame(_DebuggerComponent):
         self.debugger._send_request(self, request, request_id)
         return request_id
 
+    def expand(self, depth=1, max_nodes=10000, concurrency=32):
+        """
+        Loads scopes of this frame and their contents up to depth levels deep, one pipelined wave per level.
+
+        Stops after max_nodes variables were loaded. Returns scopes of this frame.
+        """
+        scopes = self.get_scopes()
+        _expand_containers(scopes, depth, max_nodes, concurrency)
+        return scopes
+
     def _load_scopes(self, rb):
         self.scopes = []
         for scope in rb.get_scopes():
             self.scopes.append(VariableContainer(self, scope.get_name(), "<Scope>",
                                                  "<Scope>", scope.get_variables_reference(),
-                                                 scope.get_indexed_variables_or_default([]),
-                                                 scope.get_named_variables_or_default([])))
+                                                 scope.get_indexed_variables_or_default(0),
+                                                 scope.get_named_variables_or_default(0)))
 
 
 class VariableContainer(_DebuggerComponent):
@@ -556,6 +1193,8 @@ class VariableContainer(_DebuggerComponent):
     """
     def __init__(self, parent, name, value, type, var_ref, indexed, named, eval_name=None):
         self.debugger = parent.get_debugger()
+        self.rpy_thread = parent.rpy_thread
+        self.epoch = self.rpy_thread.frame_epoch
         self.parent = parent
         self.name = name
         self.value = value
@@ -565,9 +1204,11 @@ class VariableContainer(_DebuggerComponent):
         self.named = named
         self.eval_name = eval_name
         self.variables = None
+        self.requested_count = None  # count of last variables request, None means all components
+        self.data_breakpoint_info = None
 
     def is_valid(self):
-        return self.parent.is_valid()
+        return self.rpy_thread.is_valid() and self.epoch == self.rpy_thread.frame_epoch
 
     def get_name(self):
         return self.name
@@ -578,34 +1219,324 @@ class VariableContainer(_DebuggerComponent):
     def get_type(self):
         return self.type
 
+    def get_indexed_count(self):
+        return self.indexed
+
+    def get_named_count(self):
+        return self.named
+
     def _get_components(self):
         return self.variables
 
     @_wait_cycle(_get_components)
     def get_components(self):
+        return self._request_components()
+
+    def _request_components(self, count=None):
         request_id = self.debugger.rq_counter.get()
 
-        request = DAPVariablesRequest.create(request_id, DAPVariablesArguments.create(self.var_ref))
+        arguments = DAPVariablesArguments.create(self.var_ref)
+        if count is not None:
+            arguments.set_count(count)
+        self.requested_count = count
+        request = DAPVariablesRequest.create(request_id, arguments)
         self.debugger._send_request(self, request, request_id)
         return request_id
 
-    def _load_variables(self, rb):
+    def expand(self, depth=1, max_nodes=10000, concurrency=32):
+        """
+        Loads components of this variable up to depth levels deep, one pipelined wave per level.
+
+        Stops after max_nodes variables were loaded. Returns components of this variable.
+        """
+        _expand_containers([self], depth, max_nodes, concurrency)
+        return self.variables
+
+    def _load_variables(self, rq, rb):
         self.variables = OrderedDict()
 
-        for vb in rb.get_variables():
-            name = vb.get_name()
-            self.variables[name] = VariableContainer(self, name, vb.get_value(),
-                                                     vb.get_type_or_default("<unknown>"),
-                                                     vb.get_variables_reference(),
-                                                     vb.get_indexed_variables_or_default([]),
-                                                     vb.get_named_variables_or_default([]))
+        variables = rb.get_variables()
+        count = rq.get_arguments().get_count_or_default(None)
+        if count:
+            variables = variables[:count]  # adapter ignored count
+        for vb in variables:
+            self.variables[vb.get_name()] = self._mk_variable(vb)
+
+    def _mk_variable(self, vb):
+        return VariableContainer(self, vb.get_name(), vb.get_value(),
+                                 vb.get_type_or_default("<unknown>"),
+                                 vb.get_variables_reference(),
+                                 vb.get_indexed_variables_or_default(0),
+                                 vb.get_named_variables_or_default(0))
+
+    def _get_data_breakpoint_info(self):
+        return self.data_breakpoint_info
+
+    @_wait_cycle(_get_data_breakpoint_info)
+    def get_data_breakpoint_info(self):
+        """
+        Returns DAPDataBreakpointInfoResponseBody describing whether and how this variable can be watched
+        """
+        if not isinstance(self.parent, VariableContainer):
+            raise RuntimeError("scope can't be watched")
+
+        request_id = self.debugger.rq_counter.get()
+
+        request = DAPDataBreakpointInfoRequest.create(request_id,
+                                                      DAPDataBreakpointInfoArguments.create(
+                                                          self.name, variables_reference=self.parent.var_ref))
+        self.debugger._send_request(self, request, request_id)
+        return request_id
+
+    def _load_data_breakpoint_info(self, rb):
+        self.data_breakpoint_info = rb
+
+    def watch(self, access_type="write", condition=None, hit_condition=None):
+        """
+        Registers data breakpoint on this variable, so execution stops when it is accessed.
+
+        Returns created DataBreakpoint, which stays registered until removed from debugger.
+        """
+        if not self.debugger.capabilities.get_supports_data_breakpoints_or_default(False):
+            raise RuntimeError("adapter does not support data breakpoints")
+
+        info = self.get_data_breakpoint_info()
+        data_id = info.get_data_id()
+        if data_id is None:
+            raise RuntimeError("%s can't be watched: %s" % (self.name, info.get_description()))
+
+        breakpoint = DataBreakpoint(data_id, access_type, condition, hit_condition, info.get_description())
+        self.debugger.add_data_breakpoint(breakpoint, sync=True)
+        return breakpoint
+
+    def get_indexed_window(self, page_size=None, cached_pages=None):
+        """
+        Returns windowed view of indexed children, fetched in pages on demand
+        """
+        return VariableWindow(self, "indexed", self.indexed, page_size, cached_pages)
+
+    def get_named_window(self, page_size=None, cached_pages=None):
+        """
+        Returns windowed view of named children, fetched in pages on demand
+        """
+        return VariableWindow(self, "named", self.named, page_size, cached_pages)
+
+
+class VariableWindow(_DebuggerComponent):
+    """
+    Windowed view of indexed or named children of a VariableContainer.
+
+    Children are requested in slices (filter/start/count) only when accessed and
+    least recently used pages are dropped once more than cached_pages are held.
+    """
+    def __init__(self, container, filter, count, page_size=None, cached_pages=None):
+        self.debugger = container.get_debugger()
+        self.rpy_thread = container.rpy_thread
+        self.epoch = container.epoch
+        self.container = container
+        self.filter = filter
+        self.count = count or 0
+        self.page_size = page_size or self.debugger.variables_page_size
+        self.cached_pages = cached_pages or self.debugger.variables_cached_pages
+        self.pages = OrderedDict()
+
+    def is_valid(self):
+        return self.rpy_thread.is_valid() and self.epoch == self.rpy_thread.frame_epoch
+
+    def _get_page(self, page):
+        return self.pages.get(page)
+
+    @_wait_cycle(_get_page)
+    def _load_page(self, page):
+        request_id = self.debugger.rq_counter.get()
+
+        start = page * self.page_size
+        count = min(self.page_size, self.count - start)
+        request = DAPVariablesRequest.create(request_id,
+                                             DAPVariablesArguments.create(self.container.var_ref,
+                                                                          filter=self.filter,
+                                                                          start=start, count=count))
+        self.debugger._send_request(self, request, request_id)
+        return request_id
+
+    def _load_variables(self, rq, rb):
+        arguments = rq.get_arguments()
+        start = arguments.get_start()
+        count = arguments.get_count()
+        variables = rb.get_variables()
+        if len(variables) > count:
+            # adapter ignored paging and sent all children, take the requested slice
+            variables = variables[start:start + count]
+        self.pages[start // self.page_size] = [self.container._mk_variable(vb) for vb in variables]
+
+        while len(self.pages) > self.cached_pages:
+            self.pages.popitem(last=False)
+
+    def get_page(self, page):
+        """
+        Returns list of variables of the page, fetching it if it is not cached
+        """
+        if page in self.pages:
+            variables = self.pages.pop(page)
+            self.pages[page] = variables  # mark as most recently used
+            return variables
+        return self._load_page(page, page=page)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        if index < 0:
+            index += self.count
+        if index < 0 or index >= self.count:
+            raise IndexError("variable index out of range")
+
+        variables = self.get_page(index // self.page_size)
+        offset = index % self.page_size
+        if offset >= len(variables):
+            raise IndexError("variable index out of range")
+        return variables[offset]
+
+    def __iter__(self):
+        for page in range((self.count + self.page_size - 1) // self.page_size):
+            for variable in self.get_page(page):
+                yield variable
+
+
+class VariableChanges(object):
+    """
+    Differences between two snapshots of variable trees.
+
+    Paths are tuples of variable names starting with the scope name.
+    """
+    def __init__(self):
+        self.added = OrderedDict()
+        self.removed = []
+        self.changed = OrderedDict()
+
+    def is_empty(self):
+        return len(self.added) == 0 and len(self.removed) == 0 and len(self.changed) == 0
+
+
+class VariableDiff(object):
+    """
+    Tracks changes of expanded variables between consecutive stops.
+
+    Only fingerprint of the previously expanded tree is kept (names with value and type hash).
+    On update only previously expanded paths are requested again. If trust_values is set,
+    subtree of a variable whose value and type did not change is assumed to be unchanged
+    and is not requested at all. That is only valid for adapters with stable, untruncated
+    value representations, so it is off by default.
+    """
+    def __init__(self, trust_values=False, concurrency=32):
+        self.trust_values = trust_values
+        self.concurrency = concurrency
+        self.tree = OrderedDict()
+
+    @staticmethod
+    def _hash(container):
+        return hash((container.value, container.type))
+
+    @staticmethod
+    def _cut_count(container):
+        # count children were cut off at by max_nodes, None if all children were loaded
+        count = container.requested_count
+        if count is None or container.variables is None or len(container.variables) < count:
+            return None
+        if 0 < container.indexed + container.named <= count:
+            return None
+        return count
+
+    def _mk_node(self, container):
+        # node is [value and type hash, children or None if not expanded, count children were cut off at]
+        children = None
+        if container.variables is not None:
+            children = OrderedDict()
+            for name, child in container.variables.items():
+                children[name] = self._mk_node(child)
+        return [VariableDiff._hash(container), children, VariableDiff._cut_count(container)]
+
+    def snapshot(self, roots, depth=2, max_nodes=10000):
+        """
+        Expands roots (usually scopes of a frame) and remembers fingerprint of the expanded tree
+        """
+        _expand_containers(roots, depth, max_nodes, self.concurrency)
+
+        self.tree = OrderedDict()
+        for root in roots:
+            self.tree[root.name] = self._mk_node(root)
+
+    def update(self, roots):
+        """
+        Requests previously expanded paths from new roots and returns VariableChanges against last state
+
+        Paths cut off by max_nodes in snapshot are requested with the same count, so cut children are not reported as added.
+        """
+        changes = VariableChanges()
+        tree = OrderedDict()
+        level = []
+
+        for root in roots:
+            old = self.tree.get(root.name)
+            node = [VariableDiff._hash(root), None, None]
+            tree[root.name] = node
+            if old is None:
+                changes.added[(root.name,)] = root
+            elif old[1] is not None and root.var_ref != 0:
+                level.append(((root.name,), root, node, old))
+
+        for name in self.tree:
+            if name not in tree:
+                changes.removed.append((name,))
+
+        while len(level) > 0:
+            _request_wave([container for _, container, _, _ in level], self.concurrency,
+                          [old[2] for _, _, _, old in level])
+
+            next_level = []
+            for path, container, node, old in level:
+                children = OrderedDict()
+                node[1] = children
+                node[2] = old[2]
+
+                for name, child in container.variables.items():
+                    child_path = path + (name,)
+                    child_node = [VariableDiff._hash(child), None, None]
+                    children[name] = child_node
+
+                    old_child = old[1].get(name)
+                    if old_child is None:
+                        changes.added[child_path] = child
+                        continue
+                    if old_child[0] != child_node[0]:
+                        changes.changed[child_path] = child
+
+                    if old_child[1] is None or child.var_ref == 0:
+                        continue
+                    if self.trust_values and old_child[0] == child_node[0]:
+                        child_node[1] = old_child[1]  # unchanged value, keep old subtree
+                    else:
+                        next_level.append((child_path, child, child_node, old_child))
+
+                for name in old[1]:
+                    if name not in children:
+                        changes.removed.append(path + (name,))
+
+            level = next_level
+
+        self.tree = tree
+        return changes
 
 
 class _MessageState(object):
-    def __init__(self, lock, req_id, waiter):
+    def __init__(self, lock, req_id, waiter, request):
         self._lock = lock
 
         self.req_id = req_id
+        self.request = request
         self.callback = None
         self.ready = False
         self.waiter = waiter
@@ -622,6 +1553,8 @@ class _MessageState(object):
     def set_ready(self):
         has_callback = False
         with self._lock:
+            if self.ready:
+                return  # already resolved
             self.ready = True
             has_callback = self.callback is not None
 
@@ -4,18 +4,164 @@ from __future__ import division
 from __future__ import unicode_literals
 from __future__ import absolute_import
 
+import bisect
+import hashlib
+import io
+import marshal
+import multiprocessing
+import os
+import struct
 import sys
-import traceback
+import threading
 import types
-import traceback
+import weakref
+from array import array
+from collections import OrderedDict, deque
 
+import opcode as _opcode
 from opcode import *
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 # disassembler - sane one
 
+# python 3.6+ uses 2 byte wordcode, older pythons 1 or 3 byte instructions
+_WORDCODE = sys.version_info >= (3, 6)
+# since python 3.10 jump arguments count instructions, not bytes
+_JUMP_SCALE = 2 if sys.version_info >= (3, 10) else 1
+
+# memoryview of bytes is indexed by ints only in python 3
+_as_bytes = memoryview if sys.version_info >= (3, 0) else bytearray
+
+
+def _table(ops, value=True, default=False):
+    table = [default] * 256
+    for op in ops:
+        if op < 256:  # python 3.12+ also lists pseudo instructions
+            table[op] = value
+    return table
+
+
+def _cache_table():
+    """
+    number of inline cache entries following each opcode (python 3.11+)
+    """
+    table = [0] * 256
+    entries = getattr(_opcode, "_inline_cache_entries", None)
+    if isinstance(entries, dict):
+        # python 3.13+ keys them by name
+        for name, count in entries.items():
+            if name in opmap:
+                table[opmap[name]] = count
+    elif entries is not None:
+        for op, count in enumerate(entries):
+            table[op] = count
+    return table
+
+
+def _name_shift_table():
+    """
+    some name instructions keep flags in low bits of the argument
+    """
+    table = [0] * 256
+    shifts = {}
+    if sys.version_info >= (3, 11):
+        shifts["LOAD_GLOBAL"] = 1
+    if sys.version_info >= (3, 12):
+        shifts["LOAD_ATTR"] = 1
+        shifts["LOAD_SUPER_ATTR"] = 2
+    for name, shift in shifts.items():
+        if name in opmap:
+            table[opmap[name]] = shift
+    return table
+
+
+# python 3.12+ lists instructions with argument, before that it is given by HAVE_ARGUMENT
+_HASARG = _table(getattr(_opcode, "hasarg", range(HAVE_ARGUMENT, 256)))
+_HASCONST = _table(hasconst)
+_HASNAME = _table(hasname)
+_HASJREL = _table(hasjrel)
+_HASJABS = _table(hasjabs)
+_HASLOCAL = _table(haslocal)
+_HASCOMPARE = _table(hascompare)
+_HASFREE = _table(hasfree)
+_CACHES = _cache_table()
+_NAME_SHIFT = _name_shift_table()
+_BACKWARD = _table([op for name, op in opmap.items() if "JUMP_BACKWARD" in name])
+# python 3.13+ superinstructions packing two local indexes into one argument
+_PACKED_LOCALS = _table([opmap[name] for name in ("LOAD_FAST_LOAD_FAST", "STORE_FAST_LOAD_FAST",
+                                                  "STORE_FAST_STORE_FAST") if name in opmap])
+_COMPARE_SHIFT = 5 if sys.version_info >= (3, 13) else 4 if sys.version_info >= (3, 12) else 0
+
+# optional vectorized decoding of wordcode
+# code objects smaller than NUMPY_MIN_SIZE bytes are decoded by python loop, it is faster for them
+NUMPY_MIN_SIZE = 512
+_use_numpy = numpy is not None and _WORDCODE
+if numpy is not None:
+    _NP_HASARG = numpy.array(_HASARG, dtype=bool)
+    _NP_HASCONST = numpy.array(_HASCONST, dtype=bool)
+    _NP_HASJREL = numpy.array(_HASJREL, dtype=bool)
+    _NP_HASJABS = numpy.array(_HASJABS, dtype=bool)
+    _NP_BACKWARD = numpy.array(_BACKWARD, dtype=bool)
+    _NP_SIZES = 1 + numpy.array(_CACHES, dtype=numpy.int64)
+
+
+def _jump_target(op, arg, next_offset):
+    """
+    returns jump target of instruction, next_offset is offset after its cache entries
+    """
+    if _HASJREL[op]:
+        if _BACKWARD[op]:
+            return next_offset - arg * _JUMP_SCALE
+        return next_offset + arg * _JUMP_SCALE
+    if _HASJABS[op]:
+        return arg * _JUMP_SCALE
+    return -1
+
+
+def _local_name(co, arg):
+    varname_from_oparg = getattr(co, "_varname_from_oparg", None)
+    if varname_from_oparg is not None:
+        # python 3.11+ indexes all locals, cells and free variables together
+        return varname_from_oparg(arg)
+    return co.co_varnames[arg]
+
+
+def _readable_arg(co, op, arg, next_offset):
+    """
+    resolves instruction argument into readable value (constant, name, jump target...)
+    """
+    try:
+        if _HASCONST[op]:
+            return co.co_consts[arg]
+        elif _HASNAME[op]:
+            return co.co_names[arg >> _NAME_SHIFT[op]]
+        elif _HASJREL[op] or _HASJABS[op]:
+            return _jump_target(op, arg, next_offset)
+        elif _PACKED_LOCALS[op]:
+            return (_local_name(co, arg >> 4), _local_name(co, arg & 15))
+        elif _HASLOCAL[op]:
+            return _local_name(co, arg)
+        elif _HASCOMPARE[op]:
+            return cmp_op[arg >> _COMPARE_SHIFT]
+        elif _HASFREE[op]:
+            if hasattr(co, "_varname_from_oparg"):
+                return co._varname_from_oparg(arg)
+            return (co.co_cellvars + co.co_freevars)[arg]
+    except (IndexError, ValueError):
+        # packed arguments of superinstructions are not resolved
+        pass
+    return None
+
+
 class DisElement(object):
     """
     holds disassembler instruction information
+
+    no longer created by dis(), which returns Disassembly columns, kept only for API compatibility
     """
 
     def __init__(self):
@@ -35,86 +181,726 @@ class DisElement(object):
         return (self.current, self.py_line, self.bytecode_offset, self.instruction, self.arg, self.readable_arg)
 
 
+class LineTable(object):
+    """
+    maps bytecode offsets to source lines and back
+
+    offsets and lines are parallel arrays sorted by offset, each entry starts a region of single line,
+    instructions without line (python 3.10+) have line -1
+    """
+
+    def __init__(self, co):
+        self.offsets = array(str("i"))
+        self.lines = array(str("i"))
+        self.code_size = len(co.co_code)
+
+        if hasattr(co, "co_lines"):
+            # python 3.10+, co_lines() decodes co_linetable
+            lastlineno = -2
+            for start, end, lineno in co.co_lines():
+                if lineno is None:
+                    lineno = -1
+                if lineno != lastlineno:
+                    lastlineno = lineno
+                    self.offsets.append(start)
+                    self.lines.append(lineno)
+        else:
+            for offset, lineno in _lnotab_linestarts(co):
+                self.offsets.append(offset)
+                self.lines.append(lineno)
+
+        # entry indexes ordered by line for line -> offset lookups
+        order = sorted(range(len(self.lines)), key=lambda k: (self.lines[k], self.offsets[k]))
+        order = [k for k in order if self.lines[k] >= 0]
+        self.by_line = array(str("i"), order)
+        self.sorted_lines = array(str("i"), [self.lines[k] for k in order])
+
+    def get_line(self, offset):
+        """
+        returns line of instruction at offset or None
+        """
+        k = bisect.bisect_right(self.offsets, offset) - 1
+        if k < 0 or self.lines[k] < 0:
+            return None
+        return self.lines[k]
+
+    def get_line_start(self, offset):
+        """
+        returns line if instruction at offset starts it, otherwise None
+        """
+        k = bisect.bisect_left(self.offsets, offset)
+        if k < len(self.offsets) and self.offsets[k] == offset and self.lines[k] >= 0:
+            return self.lines[k]
+        return None
+
+    def get_ranges(self, line):
+        """
+        returns list of (start, end) offset ranges of instructions of line
+        """
+        ranges = []
+        k = bisect.bisect_left(self.sorted_lines, line)
+        while k < len(self.sorted_lines) and self.sorted_lines[k] == line:
+            entry = self.by_line[k]
+            end = self.offsets[entry + 1] if entry + 1 < len(self.offsets) else self.code_size
+            ranges.append((self.offsets[entry], end))
+            k += 1
+        return ranges
+
+    def has_line(self, line):
+        """
+        returns whether any instruction belongs to line
+        """
+        k = bisect.bisect_left(self.sorted_lines, line)
+        return k < len(self.sorted_lines) and self.sorted_lines[k] == line
+
+    def next_line(self, line):
+        """
+        returns first line with instructions at or after line or None
+        """
+        k = bisect.bisect_left(self.sorted_lines, line)
+        if k < len(self.sorted_lines):
+            return self.sorted_lines[k]
+        return None
+
+    def get_lines(self):
+        """
+        returns sorted list of lines with instructions
+        """
+        lines = []
+        for line in self.sorted_lines:
+            if not lines or lines[-1] != line:
+                lines.append(line)
+        return lines
+
+    def linestarts(self):
+        """
+        generates pairs (offset, lineno) same as findlinestarts
+        """
+        for offset, line in zip(self.offsets, self.lines):
+            if line >= 0:
+                yield (offset, line)
+
+
+class Instructions(object):
+    """
+    decoded instructions stored as parallel columns
+
+    arg is -1 for instructions without argument, line is -1 unless instruction starts a line,
+    readable arguments are resolved on first access
+    """
+
+    def __init__(self):
+        self.offsets = array(str("i"))
+        self.opcodes = array(str("i"))
+        self.args = array(str("i"))
+        self.lines = array(str("i"))
+        self.readable = None
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def find(self, offset):
+        """
+        returns index of instruction at offset or -1
+        """
+        k = bisect.bisect_left(self.offsets, offset)
+        if k < len(self.offsets) and self.offsets[k] == offset:
+            return k
+        return -1
+
+    def get_readable_arg(self, co, index):
+        """
+        returns readable argument of instruction at index, co is the decoded code object
+        """
+        readable = self.readable
+        if readable is None:
+            readable = self.readable = [_UNRESOLVED] * len(self.offsets)
+        value = readable[index]
+        if value is _UNRESOLVED:
+            arg = self.args[index]
+            if arg < 0:
+                value = None
+            else:
+                op = self.opcodes[index]
+                value = _readable_arg(co, op, arg, _next_offset(op, self.offsets[index]))
+            readable[index] = value
+        return value
+
+
+_UNRESOLVED = object()
+
+
+def _next_offset(op, offset):
+    if _WORDCODE:
+        return offset + 2 + _CACHES[op] * 2
+    return offset + (3 if op >= HAVE_ARGUMENT else 1)
+
+
+class Disassembly(object):
+    """
+    disassembly of a code object, sequence of to_tuple() tuples
+
+    instructions are shared with the decode cache, instruction at lasti is marked current on access,
+    labels is sorted array of jump target offsets of the code object
+    """
+
+    def __init__(self, co, instructions, labels, lasti=-1):
+        self.co = co
+        self.instructions = instructions
+        self.labels = labels
+        self.lasti = lasti
+        self.current = instructions.find(lasti)
+
+    def get_instructions(self):
+        """
+        returns Instructions columns
+        """
+        return self.instructions
+
+    def get_readable_arg(self, index):
+        """
+        returns readable argument of instruction at index
+        """
+        return self.instructions.get_readable_arg(self.co, index)
+
+    def get_labels(self):
+        """
+        returns sorted array of jump target offsets
+        """
+        return self.labels
+
+    def is_label(self, offset):
+        """
+        returns whether offset is jump target
+        """
+        k = bisect.bisect_left(self.labels, offset)
+        return k < len(self.labels) and self.labels[k] == offset
+
+    def get_current_index(self):
+        """
+        returns index of instruction at lasti or -1
+        """
+        return self.current
+
+    def _row(self, index):
+        instructions = self.instructions
+        line = instructions.lines[index]
+        arg = instructions.args[index]
+        return (index == self.current,
+                line if line >= 0 else None,
+                instructions.offsets[index],
+                opname[instructions.opcodes[index]],
+                arg if arg >= 0 else None,
+                instructions.get_readable_arg(self.co, index))
+
+    def __len__(self):
+        return len(self.instructions)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._row(i) for i in range(*index.indices(len(self)))]
+
+        if index < 0:
+            index += len(self.instructions)
+        if index < 0 or index >= len(self.instructions):
+            raise IndexError("instruction index out of range")
+        return self._row(index)
+
+    def __iter__(self):
+        for index in range(len(self.instructions)):
+            yield self._row(index)
+
+
+class _DecodeCache(object):
+    """
+    LRU cache of decoded code objects
+
+    code objects are keyed by weak reference, entries of collected code objects are dropped
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        # weakref callbacks can run inside of locked section, so they only queue expired keys
+        self.expired = deque()
+
+    def _key(self, co):
+        try:
+            return weakref.ref(co), True
+        except TypeError:
+            return (co.co_code, co.co_consts, co.co_names, co.co_varnames, co.co_firstlineno), False
+
+    def get(self, co, decode):
+        key, weak = self._key(co)
+        with self.lock:
+            while self.expired:
+                self.entries.pop(self.expired.popleft(), None)
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.entries[key] = entry  # mark as most recently used
+                return entry
+
+        entry = decode(co)
+        if self.size <= 0:
+            return entry
+
+        if weak:
+            key = weakref.ref(co, self.expired.append)
+        with self.lock:
+            self.entries[key] = entry
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+DECODE_CACHE_SIZE = 256
+_cache = _DecodeCache(DECODE_CACHE_SIZE)
+_index_cache = _DecodeCache(DECODE_CACHE_SIZE)
+_line_cache = _DecodeCache(DECODE_CACHE_SIZE)
+
+
+def set_cache_size(size):
+    """
+    sets how many decoded code objects are cached, 0 disables the cache
+    """
+    for cache in (_cache, _index_cache, _line_cache):
+        with cache.lock:
+            cache.size = size
+            while len(cache.entries) > max(size, 0):
+                cache.entries.popitem(last=False)
+
+
+def clear_cache():
+    """
+    drops all cached decoded code objects
+    """
+    _cache.clear()
+    _index_cache.clear()
+    _line_cache.clear()
+
+
+def get_line_table(co):
+    """
+    returns cached LineTable of code object
+    """
+    return _line_cache.get(co, LineTable)
+
+
 def dis(co, lasti=-1):
     """
     disassembles a code object into tuples
+
+    decoded code objects are cached, so repeated calls only mark instruction at lasti
     """
 
-    result = []
+    instructions, labels = _cache.get(co, _load)
+    return Disassembly(co, instructions, labels, lasti)
+
+
+def dis_window(co, lasti, before=20, after=20):
+    """
+    disassembles only instructions around lasti, at most before instructions before and after after it
+
+    instruction at lasti is marked current, labels are those of whole code object
+    """
+
+    starts, labels = _index_cache.get(co, _index)
+    current = max(bisect.bisect_right(starts, lasti) - 1, 0)
+    first = max(current - before, 0)
+    last = min(current + after + 1, len(starts))
+    if first >= last:
+        return Disassembly(co, Instructions(), labels, lasti)
+
+    # argument of first instruction is extended by preceding EXTENDED_ARG chain
+    prefix = first
+    code = _as_bytes(co.co_code)
+    while prefix > 0 and code[starts[prefix - 1]] == EXTENDED_ARG:
+        prefix -= 1
+    end = starts[last] if last < len(starts) else len(code)
+
+    instructions = _decode_instructions(code, get_line_table(co), starts[prefix], end, first - prefix)
+    return Disassembly(co, instructions, labels, lasti)
 
-    code = co.co_code
-    labels = findlabels(code)
-    linestarts = dict(findlinestarts(co))
+
+def _index(co):
+    """
+    returns sorted arrays of instruction start offsets and jump target offsets
+    """
+
+    code = _as_bytes(co.co_code)
+    if _use_numpy and len(code) >= NUMPY_MIN_SIZE:
+        columns = _numpy_columns(code)
+        if columns is not None:
+            return _numpy_to_array(columns[0]), _numpy_to_array(_numpy_labels(*columns))
+    return _scan(code)
+
+
+def _scan(code):
+    """
+    single pass over byte code collecting instruction starts and jump targets
+    """
+
+    starts = array(str("i"))
     n = len(code)
+    targets = bytearray(n)
+    found = 0
     i = 0
     extended_arg = 0
-    free = None
     while i < n:
-        c = code[i]
-        op = ord(c)
-        de = DisElement()
-        result.append(de)
-
-        if i in linestarts:
-            de.python_lineno = linestarts[i]
-
-        de.current = i == lasti
-        de.bytecode_offset = i
-        de.instruction = opname[op]
-        i = i + 1
-        if op >= HAVE_ARGUMENT:
-            oparg = ord(code[i]) + ord(code[i + 1]) * 256 + extended_arg
-            extended_arg = 0
+        starts.append(i)
+        op = code[i]
+        if _WORDCODE:
+            oparg = code[i + 1] | extended_arg
+            extended_arg = oparg << 8 if op == EXTENDED_ARG else 0
+            i = i + 2 + _CACHES[op] * 2
+        else:
+            i = i + 1
+            if op < HAVE_ARGUMENT:
+                continue
+            oparg = code[i] + code[i + 1] * 256 + extended_arg
+            extended_arg = oparg * 65536 if op == EXTENDED_ARG else 0
             i = i + 2
-            if op == EXTENDED_ARG:
-                extended_arg = oparg * 65536L
-            de.arg = oparg
-
-            if op in hasconst:
-                de.readable_arg = co.co_consts[oparg]
-            elif op in hasname:
-                de.readable_arg = co.co_names[oparg]
-            elif op in hasjrel:
-                de.readable_arg = i + oparg
-            elif op in haslocal:
-                de.readable_arg = co.co_varnames[oparg]
-            elif op in hascompare:
-                de.readable_arg = cmp_op[oparg]
-            elif op in hasfree:
-                if free is None:
-                    free = co.co_cellvars + co.co_freevars
-                de.readable_arg = free[oparg]
-
-    r = [d.to_tuple() for d in result]
-    return r
+
+        if _HASJREL[op] or _HASJABS[op]:
+            label = _jump_target(op, oparg, i)
+            if 0 <= label < n and not targets[label]:
+                targets[label] = 1
+                found += 1
+
+    labels = array(str("i"))
+    if found:
+        labels.extend(offset for offset in starts if targets[offset])
+    return starts, labels
+
+
+def _decode(co):
+    """
+    decodes code object into Instructions and jump targets
+    """
+
+    code = _as_bytes(co.co_code)
+    if _use_numpy and len(code) >= NUMPY_MIN_SIZE:
+        decoded = _numpy_decode(co, code, get_line_table(co))
+        if decoded is not None:
+            return decoded
+    labels = _index_cache.get(co, _index)[1]
+    return _decode_instructions(code, get_line_table(co), 0, len(code)), labels
+
+
+def _load(co, views=True):
+    """
+    returns Instructions and jump targets from disk cache, decoding and storing them on miss
+    """
+
+    disk_cache = _disk_cache
+    if disk_cache is None:
+        return _decode(co)
+
+    key = disk_cache.key(co)
+    decoded = disk_cache.load(key, views)
+    if decoded is None:
+        decoded = _decode(co)
+        disk_cache.store(key, *decoded)
+    return decoded
+
+
+class DiskCache(object):
+    """
+    on disk cache of decoded instructions, one file per code object
+
+    file is header followed by offset, opcode, arg and line columns and jump targets as native ints,
+    it is read into single buffer and columns are views into it where memoryview supports cast (python 3.3+),
+    file is closed right after reading, so loaded code objects hold no file descriptors
+    """
+
+    FORMAT_MAGIC = b"RPYD"
+    FORMAT_VERSION = 1
+    HEADER = struct.Struct(str("=4sIII"))  # magic, version, instruction count, label count
+
+    def __init__(self, path):
+        self.path = path
+        self.prefix = _magic_number() + sys.byteorder.encode("ascii") + struct.pack(str("=B"), array(str("i")).itemsize)
+
+    def key(self, co):
+        """
+        returns hash of bytecode, line information and interpreter of code object
+        """
+        digest = hashlib.sha1(self.prefix)
+        digest.update(co.co_code)
+        digest.update(getattr(co, "co_linetable", None) or co.co_lnotab)
+        digest.update(struct.pack(str("=i"), co.co_firstlineno))
+        return digest.hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, key[:2], key[2:])
+
+    def load(self, key, views=True):
+        """
+        returns (Instructions, labels) stored under key or None
+        """
+        try:
+            with io.open(self._file(key), "rb") as f:
+                data = bytearray(os.fstat(f.fileno()).st_size)
+                if f.readinto(data) != len(data):
+                    return None
+        except (IOError, OSError):
+            return None
+
+        header = self.HEADER.size
+        if len(data) < header:
+            return None
+        magic, version, count, label_count = self.HEADER.unpack(bytes(data[:header]))
+        itemsize = array(str("i")).itemsize
+        if magic != self.FORMAT_MAGIC or version != self.FORMAT_VERSION or \
+                len(data) != header + itemsize * (4 * count + label_count):
+            return None
+
+        columns = []
+        position = header
+        for size in (count, count, count, count, label_count):
+            columns.append(self._column(data, position, size, views))
+            position += size * itemsize
+
+        instructions = Instructions()
+        instructions.offsets, instructions.opcodes, instructions.args, instructions.lines, labels = columns
+        return instructions, labels
+
+    def _column(self, data, position, size, views):
+        end = position + size * array(str("i")).itemsize
+        if views and hasattr(memoryview, "cast"):
+            return memoryview(data)[position:end].cast(str("i"))
+        column = array(str("i"))
+        if hasattr(column, "frombytes"):
+            column.frombytes(bytes(data[position:end]))
+        else:
+            column.fromstring(bytes(data[position:end]))
+        return column
+
+    def store(self, key, instructions, labels):
+        """
+        writes instructions and labels under key
+        """
+        path = self._file(key)
+        directory = os.path.dirname(path)
+        temp = "%s.%d.tmp" % (path, os.getpid())
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            with io.open(temp, "wb") as f:
+                f.write(self.HEADER.pack(self.FORMAT_MAGIC, self.FORMAT_VERSION, len(instructions), len(labels)))
+                for column in (instructions.offsets, instructions.opcodes, instructions.args, instructions.lines,
+                               labels):
+                    f.write(_column_bytes(column))
+            if hasattr(os, "replace"):
+                os.replace(temp, path)
+            else:
+                os.rename(temp, path)
+        except (IOError, OSError):
+            # cache is optimization only, another process may have won the race
+            if os.path.exists(temp):
+                os.remove(temp)
+
+
+def _column_bytes(column):
+    if isinstance(column, memoryview):
+        return column.tobytes()
+    if hasattr(column, "tobytes"):
+        return column.tobytes()
+    return column.tostring()
+
+
+_disk_cache = None
+
+
+def set_disk_cache(path):
+    """
+    enables on disk cache of decoded instructions in directory path, None disables it
+    """
+    global _disk_cache
+    _disk_cache = DiskCache(path) if path is not None else None
+
+
+def set_numpy_backend(enabled):
+    """
+    enables or disables numpy decoding of wordcode (python 3.6+)
+    """
+    global _use_numpy
+    if enabled and (numpy is None or not _WORDCODE):
+        raise RuntimeError("numpy backend is not available")
+    _use_numpy = enabled
+
+
+def _numpy_to_array(values):
+    result = array(str("i"))
+    data = values.astype(numpy.intc).tobytes()
+    if hasattr(result, "frombytes"):
+        result.frombytes(data)
+    else:
+        result.fromstring(data)
+    return result
+
+
+def _numpy_columns(code):
+    """
+    vectorized wordcode decoding, returns numpy arrays (offsets, opcodes, args, next offsets)
+
+    args include EXTENDED_ARG prefixes and are -1 for instructions without argument,
+    returns None if inline caches can not be told apart from instructions
+    """
+
+    units = numpy.frombuffer(code, dtype=numpy.uint8)
+    ops = units[0::2].astype(numpy.intp)
+    raw = units[1::2].astype(numpy.int64)
+
+    starts = None
+    if "CACHE" in opmap:
+        # python 3.11+ co_code has zeroed cache entries
+        starts = numpy.flatnonzero(ops != opmap["CACHE"])
+        if len(starts):
+            following = starts + _NP_SIZES[ops[starts]]
+            if starts[0] != 0 or following[-1] != len(ops) or numpy.any(following[:-1] != starts[1:]):
+                return None
+        ops = ops[starts]
+        raw = raw[starts]
+    else:
+        starts = numpy.arange(len(ops))
+
+    # EXTENDED_ARG prefixes provide higher bytes of argument, chain is at most 3 prefixes long
+    n = len(ops)
+    extended = ops == EXTENDED_ARG
+    args = raw.copy()
+    chain = numpy.ones(n, dtype=bool)
+    for depth in (1, 2, 3):
+        prefixed = numpy.zeros(n, dtype=bool)
+        prefixed[depth:] = extended[:n - depth]
+        chain &= prefixed
+        if not chain.any():
+            break
+        shifted = numpy.zeros(n, dtype=numpy.int64)
+        shifted[depth:] = raw[:n - depth]
+        args |= numpy.where(chain, shifted << (8 * depth), 0)
+
+    offsets = starts * 2
+    next_offsets = offsets + _NP_SIZES[ops] * 2
+    args = numpy.where(_NP_HASARG[ops], args, -1)
+    return offsets, ops, args, next_offsets
+
+
+def _numpy_labels(offsets, ops, args, next_offsets):
+    """
+    vectorized jump target detection, returns sorted numpy array of targets
+    """
+
+    relative = _NP_HASJREL[ops]
+    jumps = relative | _NP_HASJABS[ops]
+    distance = args * _JUMP_SCALE
+    targets = numpy.where(relative,
+                          numpy.where(_NP_BACKWARD[ops], next_offsets - distance, next_offsets + distance),
+                          distance)
+    return numpy.intersect1d(targets[jumps], offsets)
+
+
+def _numpy_decode(co, code, line_table):
+    """
+    decodes code object into Instructions and jump targets with numpy or returns None
+    """
+
+    columns = _numpy_columns(code)
+    if columns is None:
+        return None
+    offsets, ops, args, next_offsets = columns
+
+    line_starts = numpy.asarray(line_table.offsets, dtype=numpy.int64)
+    lines = numpy.full(len(offsets), -1, dtype=numpy.int64)
+    if len(line_starts):
+        k = numpy.minimum(numpy.searchsorted(line_starts, offsets), len(line_starts) - 1)
+        starts_line = line_starts[k] == offsets
+        lines[starts_line] = numpy.asarray(line_table.lines, dtype=numpy.int64)[k[starts_line]]
+
+    instructions = Instructions()
+    instructions.offsets = _numpy_to_array(offsets)
+    instructions.opcodes = _numpy_to_array(ops)
+    instructions.args = _numpy_to_array(args)
+    instructions.lines = _numpy_to_array(lines)
+
+    # constants are resolved right away, other readable arguments stay lazy
+    constants = numpy.flatnonzero(_NP_HASCONST[ops] & (args >= 0) & (args < len(co.co_consts)))
+    if len(constants):
+        readable = instructions.readable = [_UNRESOLVED] * len(offsets)
+        consts = co.co_consts
+        for index, arg in zip(constants.tolist(), args[constants].tolist()):
+            readable[index] = consts[arg]
+    return instructions, _numpy_to_array(_numpy_labels(offsets, ops, args, next_offsets))
+
+
+def _decode_instructions(code, line_table, start, end, skip=0):
+    """
+    decodes instructions from offset start to offset end into Instructions, first skip instructions are dropped
+    """
+
+    instructions = Instructions()
+    add_offset = instructions.offsets.append
+    add_opcode = instructions.opcodes.append
+    add_arg = instructions.args.append
+    add_line = instructions.lines.append
+
+    # line table entries are walked along with instructions
+    offsets = line_table.offsets
+    lines = line_table.lines
+    entries = len(offsets)
+    k = bisect.bisect_left(offsets, start)
+
+    n = end
+    i = start
+    extended_arg = 0
+    while i < n:
+        op = code[i]
+        add_offset(i)
+        add_opcode(op)
+
+        while k < entries and offsets[k] < i:
+            k += 1
+        if k < entries and offsets[k] == i:
+            add_line(lines[k])
+        else:
+            add_line(-1)
+
+        if _WORDCODE:
+            oparg = code[i + 1] | extended_arg
+            extended_arg = oparg << 8 if op == EXTENDED_ARG else 0
+            i = i + 2 + _CACHES[op] * 2
+            add_arg(oparg if _HASARG[op] else -1)
+        else:
+            i = i + 1
+            if op >= HAVE_ARGUMENT:
+                oparg = code[i] + code[i + 1] * 256 + extended_arg
+                extended_arg = 0
+                i = i + 2
+                if op == EXTENDED_ARG:
+                    extended_arg = oparg * 65536
+                add_arg(oparg)
+            else:
+                add_arg(-1)
+
+    if skip:
+        for column in (instructions.offsets, instructions.opcodes, instructions.args, instructions.lines):
+            del column[:skip]
+    return instructions
 
 
 def findlabels(code):
     """
     detect all offsets in a byte code which are jump targets
 
-    return the list of offsets
+    return the sorted list of offsets
     """
 
-    labels = []
-    n = len(code)
-    i = 0
-    while i < n:
-        c = code[i]
-        op = ord(c)
-        i = i + 1
-        if op >= HAVE_ARGUMENT:
-            oparg = ord(code[i]) + ord(code[i + 1]) * 256
-            i = i + 2
-            label = -1
-            if op in hasjrel:
-                label = i + oparg
-            elif op in hasjabs:
-                label = oparg
-            if label >= 0:
-                if label not in labels:
-                    labels.append(label)
-    return labels
+    return list(_scan(_as_bytes(code))[1])
 
 
 def findlinestarts(code):
@@ -124,8 +910,17 @@ def findlinestarts(code):
     generate pairs (offset, lineno) as described in Python/compile.c
     """
 
-    byte_increments = [ord(c) for c in code.co_lnotab[0::2]]
-    line_increments = [ord(c) for c in code.co_lnotab[1::2]]
+    return get_line_table(code).linestarts()
+
+
+def _lnotab_linestarts(code):
+    """
+    generates pairs (offset, lineno) from co_lnotab (python < 3.10)
+    """
+
+    lnotab = bytearray(code.co_lnotab)
+    byte_increments = lnotab[0::2]
+    line_increments = lnotab[1::2]
 
     lastlineno = None
     lineno = code.co_firstlineno
@@ -136,6 +931,128 @@ def findlinestarts(code):
                 yield (addr, lineno)
                 lastlineno = lineno
             addr += byte_incr
+        if _WORDCODE and line_incr >= 0x80:
+            # python 3.6+ line increments are signed
+            line_incr -= 0x100
         lineno += line_incr
     if lineno != lastlineno:
         yield (addr, lineno)
+
+
+# disassembly of whole code object trees
+
+
+def iter_code_objects(co):
+    """
+    yields code object and all code objects nested in its constants
+    """
+
+    stack = [co]
+    while stack:
+        co = stack.pop()
+        yield co
+        for const in co.co_consts:
+            if isinstance(const, types.CodeType):
+                stack.append(const)
+
+
+def _magic_number():
+    try:
+        from importlib.util import MAGIC_NUMBER
+        return MAGIC_NUMBER
+    except ImportError:
+        import imp
+        return imp.get_magic()
+
+
+def load_code(path):
+    """
+    loads module code object from python source or compiled .pyc file of this interpreter
+    """
+
+    with io.open(path, "rb") as f:
+        data = f.read()
+
+    if not path.endswith(".pyc"):
+        return compile(data, path, "exec", 0, True)
+
+    magic = _magic_number()
+    if data[:len(magic)] != magic:
+        raise RuntimeError("%s was not compiled by this python version" % path)
+    if sys.version_info >= (3, 7):
+        header = 16
+    elif sys.version_info >= (3, 3):
+        header = 12
+    else:
+        header = 8
+    return marshal.loads(data[header:])
+
+
+# code objects of trees held by pool worker processes
+_tree_codes = None
+
+
+def _tree_worker_init(roots, disk_cache_path):
+    global _tree_codes
+    set_disk_cache(disk_cache_path)
+    _tree_codes = [list(iter_code_objects(marshal.loads(root))) for root in roots]
+
+
+def _tree_worker(task):
+    """
+    decodes code objects start:stop of root tree in worker process
+    """
+
+    root, start, stop = task
+    results = []
+    for co in _tree_codes[root][start:stop]:
+        instructions, labels = _load(co, views=False)
+        # readable arguments can hold unpicklable values, parent resolves them again
+        instructions.readable = None
+        results.append((instructions, labels))
+    return root, start, results
+
+
+def disassemble_tree(root_code_or_paths, workers=None, chunk_size=None):
+    """
+    disassembles code objects and all code objects nested in their constants in a pool of processes
+
+    root_code_or_paths is code object, path to .py/.pyc file or list of them,
+    generates pairs (code object, Disassembly) in order of completion
+    """
+
+    if isinstance(root_code_or_paths, (list, tuple)):
+        roots = list(root_code_or_paths)
+    else:
+        roots = [root_code_or_paths]
+    roots = [root if isinstance(root, types.CodeType) else load_code(root) for root in roots]
+    trees = [list(iter_code_objects(root)) for root in roots]
+
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    if workers <= 1:
+        for codes in trees:
+            for co in codes:
+                yield co, dis(co)
+        return
+
+    total = sum(len(codes) for codes in trees)
+    if chunk_size is None:
+        # several chunks per worker so results stream back and load stays balanced
+        chunk_size = max(1, total // (workers * 8))
+    tasks = [(root, start, min(start + chunk_size, len(codes)))
+             for root, codes in enumerate(trees)
+             for start in range(0, len(codes), chunk_size)]
+
+    disk_cache_path = _disk_cache.path if _disk_cache is not None else None
+    pool = multiprocessing.Pool(workers, _tree_worker_init, ([marshal.dumps(root) for root in roots], disk_cache_path))
+    try:
+        for root, start, results in pool.imap_unordered(_tree_worker, tasks):
+            codes = trees[root]
+            for index, (instructions, labels) in enumerate(results):
+                co = codes[start + index]
+                yield co, Disassembly(co, instructions, labels)
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
@@ -0,0 +1,5 @@
+# py23 compatible
+from __future__ import print_function
+from __future__ import division
+from __future__ import unicode_literals
+from __future__ import absolute_import
@@ -0,0 +1,124 @@
+# py23 compatible
+from __future__ import print_function
+from __future__ import division
+from __future__ import unicode_literals
+from __future__ import absolute_import
+
+import unittest
+
+from ..breakpoints import Breakpoint, DataBreakpoint, FunctionBreakpoint
+from ..debugger import RenpyDebugger
+from ..protocol import DAPBreakpoint, DAPBreakpointEvent, DAPBreakpointEventBody, DAPSetBreakpointsResponseBody, \
+    DAPSetDataBreakpointsResponseBody, DAPSetFunctionBreakpointsResponseBody, DAPSource
+
+
+def _request_lines(request):
+    return [sb.get_line() for sb in request.get_arguments().get_breakpoints()]
+
+
+def _respond(store, request):
+    lines = _request_lines(request)
+    store._load_breakpoints(request, DAPSetBreakpointsResponseBody.create([DAPBreakpoint.create(True, line=line)
+                                                                           for line in lines]))
+
+
+class SourceBreakpointSyncTest(unittest.TestCase):
+    """
+    setBreakpoints requests are built without adapter, responses are fed to the store by hand
+    """
+
+    def setUp(self):
+        self.debugger = RenpyDebugger("127.0.0.1", 0)
+
+    def test_remove_while_add_is_in_flight(self):
+        breakpoint = Breakpoint(10, "/a.rpy")
+        self.debugger.add_breakpoint(breakpoint)
+        (store, add_request), = self.debugger._mk_breakpoints()
+        self.assertEqual(_request_lines(add_request), [10])
+
+        # adapter did not respond yet
+        self.debugger.remove_breakpoint(breakpoint)
+        (store, remove_request), = self.debugger._mk_breakpoints()
+        self.assertEqual(_request_lines(remove_request), [])
+
+        _respond(store, add_request)
+        _respond(store, remove_request)
+        self.assertEqual(store.get_adapter_lines("/a.rpy"), [])
+
+    def test_unchanged_source_is_not_sent_again(self):
+        self.debugger.add_breakpoint(Breakpoint(10, "/a.rpy"))
+        self.assertEqual(len(self.debugger._mk_breakpoints()), 1)
+
+        self.debugger.breakpoints.mark_all_dirty()
+        self.assertEqual(self.debugger._mk_breakpoints(), [])
+
+
+class KeyedBreakpointSyncTest(unittest.TestCase):
+    """
+    setFunctionBreakpoints and setDataBreakpoints requests are built without adapter
+    """
+
+    def setUp(self):
+        self.debugger = RenpyDebugger("127.0.0.1", 0)
+        self.debugger.capabilities.set_supports_function_breakpoints(True)
+        self.debugger.capabilities.set_supports_data_breakpoints(True)
+
+    def test_remove_function_breakpoint_while_add_is_in_flight(self):
+        self.debugger.add_function_breakpoint(FunctionBreakpoint("start"))
+        (store, add_request), = self.debugger._mk_breakpoints()
+        self.assertEqual([b.get_name() for b in add_request.get_arguments().get_breakpoints()], ["start"])
+
+        self.debugger.remove_function_breakpoint("start")
+        (store, remove_request), = self.debugger._mk_breakpoints()
+        self.assertEqual(remove_request.get_arguments().get_breakpoints(), [])
+
+        store._load_breakpoints(add_request, DAPSetFunctionBreakpointsResponseBody.create([DAPBreakpoint.create(True)]))
+        store._load_breakpoints(remove_request, DAPSetFunctionBreakpointsResponseBody.create([]))
+        self.assertEqual(self.debugger._mk_breakpoints(), [])
+
+    def test_remove_data_breakpoint_while_add_is_in_flight(self):
+        self.debugger.add_data_breakpoint(DataBreakpoint("x"))
+        (store, add_request), = self.debugger._mk_breakpoints()
+        self.assertEqual([b.get_data_id() for b in add_request.get_arguments().get_breakpoints()], ["x"])
+
+        self.debugger.remove_data_breakpoint("x")
+        (store, remove_request), = self.debugger._mk_breakpoints()
+        self.assertEqual(remove_request.get_arguments().get_breakpoints(), [])
+
+        store._load_breakpoints(add_request, DAPSetDataBreakpointsResponseBody.create([DAPBreakpoint.create(True)]))
+        store._load_breakpoints(remove_request, DAPSetDataBreakpointsResponseBody.create([]))
+        self.assertEqual(self.debugger._mk_breakpoints(), [])
+
+
+class BreakpointEventTest(unittest.TestCase):
+    """
+    breakpoint events are resolved by adapter id across all stores before source and line
+    """
+
+    def setUp(self):
+        self.debugger = RenpyDebugger("127.0.0.1", 0)
+        self.debugger.capabilities.set_supports_function_breakpoints(True)
+
+    def test_function_breakpoint_event_does_not_touch_line_breakpoint(self):
+        breakpoint = Breakpoint(10, "/a.rpy")
+        function_breakpoint = FunctionBreakpoint("start")
+        self.debugger.add_breakpoint(breakpoint)
+        self.debugger.add_function_breakpoint(function_breakpoint)
+        requests = dict((type(store), request) for store, request in self.debugger._mk_breakpoints())
+
+        self.debugger.breakpoints._load_breakpoints(
+            requests[type(self.debugger.breakpoints)],
+            DAPSetBreakpointsResponseBody.create([DAPBreakpoint.create(True, id=1, line=10)]))
+        self.debugger.function_breakpoints._load_breakpoints(
+            requests[type(self.debugger.function_breakpoints)],
+            DAPSetFunctionBreakpointsResponseBody.create([DAPBreakpoint.create(True, id=2)]))
+
+        removed = DAPBreakpoint.create(False, id=2, source=DAPSource.create(path="/a.rpy"), line=10)
+        self.debugger._resolve_breakpoint_event(DAPBreakpointEvent.create(0, DAPBreakpointEventBody.create("removed",
+                                                                                                           removed)))
+        self.assertEqual((breakpoint.adapter_id, breakpoint.verified), (1, True))
+        self.assertIsNone(function_breakpoint.adapter_id)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+# py23 compatible
+from __future__ import print_function
+from __future__ import division
+from __future__ import unicode_literals
+from __future__ import absolute_import
+
+import unittest
+
+from .. import cfg
+from .. import dis
+
+_SOURCE = """
+def f(x):
+    while x:
+        if x > 1:
+            break
+        x -= 1
+    try:
+        y = 1 / x
+    except ZeroDivisionError:
+        y = 0
+    return y
+"""
+
+
+def _compile(source):
+    namespace = {}
+    exec(compile(source, "<cfg>", "exec"), namespace)
+    return namespace["f"].__code__
+
+
+class ReachabilityTest(unittest.TestCase):
+    """
+    lines are relative to def line of _SOURCE
+    """
+
+    def setUp(self):
+        self.co = _compile(_SOURCE)
+        self.graph = cfg.ControlFlowGraph(self.co)
+
+    def reachable(self, line):
+        first = self.co.co_firstlineno
+        offset = min(offset for offset, start in dis.findlinestarts(self.co) if start == first + line)
+        return [reachable - first for reachable in self.graph.get_reachable_lines(offset)]
+
+    def test_break_leaves_loop(self):
+        reachable = self.reachable(3)
+        self.assertNotIn(4, reachable)
+        self.assertNotIn(2, reachable)
+        for line in (6, 8, 9):
+            self.assertIn(line, reachable)
+
+    def test_while_body_loops(self):
+        reachable = self.reachable(4)
+        for line in (1, 2, 3, 4, 9):
+            self.assertIn(line, reachable)
+
+    def test_handler_reachable_from_try_body(self):
+        reachable = self.reachable(6)
+        self.assertEqual([line for line in reachable if line < 6], [])
+        for line in (8, 9):
+            self.assertIn(line, reachable)
+
+    def test_handler_is_not_reachable_after_try(self):
+        self.assertEqual(self.reachable(9), [9])
+
+    def test_blocks_cover_instructions(self):
+        for co in dis.iter_code_objects(dis.load_code(cfg.__file__.replace(".pyc", ".py"))):
+            graph = cfg.ControlFlowGraph(co)
+            self.assertEqual(sum(block.end - block.start for block in graph.get_blocks()), len(dis.dis(co)))
+            for block in graph.get_blocks():
+                self.assertIs(graph.get_block(block.start_offset), block)
+                for successor in block.successors:
+                    self.assertIn(block.index, graph.get_blocks()[successor].predecessors)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,185 @@
+# py23 compatible
+from __future__ import print_function
+from __future__ import division
+from __future__ import unicode_literals
+from __future__ import absolute_import
+
+import argparse
+import dis as std_dis
+import inspect
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from .. import dis
+
+
+def _code_objects():
+    return list(dis.iter_code_objects(dis.load_code(inspect.getsourcefile(argparse))))
+
+
+def _extended_arg_code():
+    # more names than fit into a single argument byte (python 2 arguments have two bytes)
+    count = 300 if dis._WORDCODE else 70000
+    source = "def f():\n    return [%s]\n" % ", ".join("g%d" % i for i in range(count))
+    namespace = {}
+    exec(compile(source, "<extended>", "exec"), namespace)
+    return namespace["f"].__code__
+
+
+def _std_starts_line(instruction):
+    if sys.version_info >= (3, 13):
+        return instruction.line_number if instruction.starts_line else None
+    return instruction.starts_line
+
+
+class StdlibComparisonTest(unittest.TestCase):
+    """
+    decoded instructions, jump targets and line starts match the stdlib dis module of running python
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.codes = _code_objects() + [_extended_arg_code()]
+
+    def test_instructions(self):
+        if not hasattr(std_dis, "get_instructions"):
+            self.skipTest("dis.get_instructions needs python 3.4+")
+
+        jumps = set(std_dis.hasjrel + std_dis.hasjabs)
+        resolved = set(std_dis.hasconst + std_dis.hasname + std_dis.haslocal + std_dis.hasfree)
+        unknown = getattr(std_dis, "UNKNOWN", None)  # python 3.11 can't resolve KW_NAMES
+        for co in self.codes:
+            expected = [i for i in std_dis.get_instructions(co) if i.opname != "CACHE"]
+            rows = list(dis.dis(co))
+            self.assertEqual(len(rows), len(expected), co)
+            for instruction, (_, line, offset, name, arg, readable) in zip(expected, rows):
+                self.assertEqual((offset, name, arg), (instruction.offset, instruction.opname, instruction.arg), co)
+                if instruction.opcode in jumps:
+                    self.assertEqual(readable, instruction.argval, co)
+                elif instruction.opcode in resolved and instruction.argval is not unknown:
+                    self.assertEqual(readable, instruction.argval, co)
+                if _std_starts_line(instruction) is not None:
+                    self.assertEqual(line, _std_starts_line(instruction), co)
+
+    def test_labels(self):
+        for co in self.codes:
+            self.assertEqual(dis.findlabels(co.co_code), sorted(std_dis.findlabels(co.co_code)), co)
+            self.assertEqual(list(dis.dis(co).get_labels()), sorted(std_dis.findlabels(co.co_code)), co)
+
+    def test_line_starts(self):
+        for co in self.codes:
+            expected = [(offset, line) for offset, line in std_dis.findlinestarts(co) if line is not None]
+            starts = list(dis.findlinestarts(co))
+            if hasattr(co, "co_lines"):
+                # stdlib does not repeat line entered again after instructions without line
+                self.assertTrue(set(expected) <= set(starts), co)
+            else:
+                self.assertEqual(starts, expected, co)
+
+
+class NumpyBackendTest(unittest.TestCase):
+    """
+    numpy backend decodes the same columns and jump targets as python one
+    """
+
+    def setUp(self):
+        if dis.numpy is None or not dis._WORDCODE:
+            self.skipTest("numpy backend needs numpy and python 3.6+")
+        self.enabled = dis._use_numpy
+        self.min_size = dis.NUMPY_MIN_SIZE
+        dis.NUMPY_MIN_SIZE = 0
+
+    def tearDown(self):
+        dis.NUMPY_MIN_SIZE = self.min_size
+        dis.set_numpy_backend(self.enabled)
+
+    def test_same_columns(self):
+        for co in _code_objects() + [_extended_arg_code()]:
+            dis.set_numpy_backend(True)
+            vectorized, vectorized_labels = dis._decode(co)
+            dis.set_numpy_backend(False)
+            instructions, labels = dis._decode(co)
+
+            for name in ("offsets", "opcodes", "args", "lines"):
+                self.assertEqual(list(getattr(vectorized, name)), list(getattr(instructions, name)), (co, name))
+            self.assertEqual(list(vectorized_labels), list(labels), co)
+
+
+class WindowTest(unittest.TestCase):
+    """
+    dis_window rows are the same as rows of whole disassembly
+    """
+
+    def test_window_starting_after_extended_arg(self):
+        co = _extended_arg_code()
+        rows = list(dis.dis(co))
+        extended = [k for k, row in enumerate(rows) if row[3] == "EXTENDED_ARG" and rows[k + 1][3] != "EXTENDED_ARG"]
+        self.assertTrue(extended)
+
+        for k in extended[:20]:
+            offset = rows[k + 1][2]
+            window = list(dis.dis_window(co, offset, before=0, after=1))
+            self.assertEqual(window, list(dis.dis(co, offset))[k + 1:k + 3])
+
+    def test_window_around_lasti(self):
+        co = _extended_arg_code()
+        rows = list(dis.dis(co))
+        offset = rows[len(rows) // 2][2]
+        window = dis.dis_window(co, offset, before=3, after=2)
+        self.assertEqual(list(window), list(dis.dis(co, offset))[len(rows) // 2 - 3:len(rows) // 2 + 3])
+        self.assertEqual(window.get_current_index(), 3)
+
+
+class DiskCacheTest(unittest.TestCase):
+    """
+    instructions loaded from disk cache are the same as decoded ones
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.codes = _code_objects()
+        self.expected = [(list(dis.dis(co)), list(dis.dis(co).get_labels())) for co in self.codes]
+        dis.set_disk_cache(self.directory)
+        dis.clear_cache()
+
+    def tearDown(self):
+        dis.set_disk_cache(None)
+        dis.clear_cache()
+        shutil.rmtree(self.directory)
+
+    def assert_decoded(self):
+        for co, expected in zip(self.codes, self.expected):
+            disassembly = dis.dis(co)
+            self.assertEqual((list(disassembly), list(disassembly.get_labels())), expected, co)
+
+    def test_load_stored(self):
+        self.assert_decoded()  # decodes and stores
+        dis.clear_cache()
+        self.assert_decoded()
+
+        for co in self.codes:
+            instructions, labels = dis._load(co, views=False)
+            loaded, loaded_labels = dis._disk_cache.load(dis._disk_cache.key(co))
+            for name in ("offsets", "opcodes", "args", "lines"):
+                self.assertEqual(list(getattr(loaded, name)), list(getattr(instructions, name)), (co, name))
+            self.assertEqual(list(loaded_labels), list(labels), co)
+
+    def test_corrupted_file_is_decoded_again(self):
+        self.assert_decoded()
+        for co in self.codes:
+            with open(dis._disk_cache._file(dis._disk_cache.key(co)), "r+b") as f:
+                f.truncate(10)
+        dis.clear_cache()
+        self.assert_decoded()
+
+    def test_missing_directory_is_created(self):
+        shutil.rmtree(self.directory)
+        self.assert_decoded()
+        self.assertTrue(os.listdir(self.directory))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,6 +5,7 @@ from __future__ import unicode_literals
 from __future__ import absolute_import
 
 import sys
+import threading
 
 class NoneDict(dict):
     """
@@ -63,8 +64,10 @@ def to_str(raw):
 class Counter(object):
     def __init__(self):
         self.state = 0
+        self._lock = threading.Lock()
 
     def get(self):
-        s = self.state
-        self.state += 1
+        with self._lock:
+            s = self.state
+            self.state += 1
         return s